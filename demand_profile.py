@@ -0,0 +1,48 @@
+import csv
+from typing import List, Optional, Tuple
+
+
+class DemandProfile:
+    def __init__(self, path: str):
+        """
+        Time-varying vehicle generation rates, streamed from a CSV schedule with the columns
+        time (simulation seconds), generator (index) and rate (vehicles per minute), sorted by time.
+        A header row is optional
+        """
+        self._file = open(path, newline='')
+        self._reader = csv.reader(self._file)
+        self._next_row: Optional[Tuple[float, int, float]] = None
+        self._read_row(skip_header=True)
+
+    def _read_row(self, skip_header: bool = False) -> None:
+        for row in self._reader:
+            if not row or row[0].lstrip().startswith('#'):
+                continue
+            try:
+                self._next_row = (float(row[0]), int(row[1]), float(row[2]))
+                return
+            except ValueError:
+                if not skip_header:
+                    raise
+                skip_header = False
+        # Schedule exhausted
+        self._next_row = None
+        self._file.close()
+
+    def close(self) -> None:
+        """ Closes the schedule file, if the schedule wasn't exhausted yet """
+        self._next_row = None
+        self._file.close()
+
+    @property
+    def next_time(self) -> Optional[float]:
+        """ Returns the time of the next rate change, None once the schedule is exhausted """
+        return self._next_row[0] if self._next_row else None
+
+    def pop_due(self, t: float) -> List[Tuple[int, float]]:
+        """ Returns the (generator index, rate) changes scheduled until t """
+        changes = []
+        while self._next_row and self._next_row[0] <= t:
+            changes.append(self._next_row[1:])
+            self._read_row()
+        return changes
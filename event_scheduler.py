@@ -0,0 +1,56 @@
+from heapq import heappop, heappush
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+class EventScheduler:
+    def __init__(self):
+        """
+        Min-heap of due times. Each entry has a callback, called with the current simulation time
+        when the entry is due, which returns its next due time (None to leave it unscheduled)
+        """
+        self._heap: List[Tuple[float, int, int]] = []  # (due time, priority, handle)
+        self._due: Dict[int, float] = {}  # {handle: due time}, the heap may hold outdated due times
+        self._callbacks: List[Callable[[float], Optional[float]]] = []
+        self._priorities: List[int] = []
+        # Handles of the current run_due call that didn't run yet
+        self._pending: Set[int] = set()
+
+    def register(self, callback: Callable[[float], Optional[float]], due_time: Optional[float] = None,
+                 priority: int = 0) -> int:
+        """ Registers an entry and returns its handle. Entries due at the same time run by increasing
+        priority, then in registration order """
+        self._callbacks.append(callback)
+        self._priorities.append(priority)
+        handle = len(self._callbacks) - 1
+        self.reschedule(handle, due_time)
+        return handle
+
+    def reschedule(self, handle: int, due_time: Optional[float]) -> None:
+        """ Replaces the due time of an entry, or unschedules it if due_time is None. An entry
+        rescheduled by a callback doesn't run in the current run_due call anymore """
+        self._pending.discard(handle)
+        if due_time is None:
+            self._due.pop(handle, None)
+            return
+        self._due[handle] = due_time
+        heappush(self._heap, (due_time, self._priorities[handle], handle))
+
+    def run_due(self, t: float) -> None:
+        """ Calls the callbacks of the entries due until t. Entries rescheduled to t or
+        earlier by the callbacks run upon the next call """
+        due: List[int] = []
+        while self._heap and self._heap[0][0] <= t:
+            due_time, _, handle = heappop(self._heap)
+            # Skip outdated heap items (rescheduled or unscheduled entries)
+            if self._due.get(handle) == due_time:
+                del self._due[handle]
+                due.append(handle)
+        pending = self._pending
+        pending.update(due)
+        for handle in due:
+            if handle not in pending:
+                continue
+            pending.discard(handle)
+            next_due_time = self._callbacks[handle](t)
+            if next_due_time is not None and handle not in self._due:
+                self.reschedule(handle, next_due_time)
@@ -0,0 +1,240 @@
+from math import hypot
+from typing import Dict, List, Optional, Set, Tuple
+
+from curve import TURN_LEFT, TURN_RIGHT, turn_road
+from simulation import Simulation
+
+# Directions of travel, in screen coordinates (y grows downwards)
+EAST, SOUTH, WEST, NORTH = (1, 0), (0, 1), (-1, 0), (0, -1)
+DIRECTIONS = (EAST, SOUTH, WEST, NORTH)
+
+# Traffic signal groups, by direction of travel of the inbound lanes
+SIGNAL_GROUP_DIRECTIONS = (SOUTH, WEST, NORTH, EAST)
+# Vehicles don't yield, so each approach gets a protected green of its own, followed by a clearance
+# (all red) phase for the vehicles still crossing the junction
+DEFAULT_CYCLE = [phase for group in range(len(SIGNAL_GROUP_DIRECTIONS))
+                 for phase in (tuple(i == group for i in range(len(SIGNAL_GROUP_DIRECTIONS))),
+                               (False,) * len(SIGNAL_GROUP_DIRECTIONS))]
+DEFAULT_DURATIONS = [10, 4] * len(SIGNAL_GROUP_DIRECTIONS)  # Green and clearance seconds
+
+
+def _right(direction: Tuple[int, int]) -> Tuple[int, int]:
+    """ Returns the direction to the right of the given one (vehicles drive on the right) """
+    return -direction[1], direction[0]
+
+
+def _left(direction: Tuple[int, int]) -> Tuple[int, int]:
+    return direction[1], -direction[0]
+
+
+def _cross(o, a, b) -> float:
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _segments_intersect(p1, p2, q1, q2) -> bool:
+    """ Whether the segments p1p2 and q1q2 intersect, touching included """
+    def on_segment(a, b, c):
+        return min(a[0], b[0]) - 1e-9 <= c[0] <= max(a[0], b[0]) + 1e-9 and \
+            min(a[1], b[1]) - 1e-9 <= c[1] <= max(a[1], b[1]) + 1e-9
+
+    d1, d2 = _cross(q1, q2, p1), _cross(q1, q2, p2)
+    d3, d4 = _cross(p1, p2, q1), _cross(p1, p2, q2)
+    if ((d1 > 0 > d2) or (d1 < 0 < d2)) and ((d3 > 0 > d4) or (d3 < 0 < d4)):
+        return True
+    return (abs(d1) < 1e-9 and on_segment(q1, q2, p1)) or (abs(d2) < 1e-9 and on_segment(q1, q2, p2)) or \
+        (abs(d3) < 1e-9 and on_segment(p1, p2, q1)) or (abs(d4) < 1e-9 and on_segment(p1, p2, q2))
+
+
+class GridScenario:
+    def __init__(self, n_rows: int, n_cols: int, spacing: float = 100, approach_length: float = 100,
+                 junction_size: float = 12, lane_offset: float = 2, turn_resolution: int = 5):
+        """
+        Builds the road geometry of a n_rows x n_cols grid of signalized junctions. Every street has
+        one lane per direction, and every junction connects each inbound lane to the outbound lanes
+        going straight, left and right (curve.turn_road turns)
+        :param spacing: distance between neighbouring junction centres
+        :param approach_length: length of the perimeter entry and exit lanes
+        :param junction_size: side of the square junction box
+        :param lane_offset: distance of each lane to the street axis
+        :param turn_resolution: number of straight roads approximating each turn
+        """
+        self.n_rows: int = n_rows
+        self.n_cols: int = n_cols
+        self._spacing: float = spacing
+        self._approach_length: float = approach_length
+        self._half_size: float = junction_size / 2
+        self._lane_offset: float = lane_offset
+        self._turn_resolution: int = turn_resolution
+
+        self.roads: List[Tuple[Tuple[float, float], Tuple[float, float]]] = []
+        # {(row, col, direction of travel): index of the lane arriving at the junction}
+        self.inbound_lanes: Dict[Tuple[int, int, Tuple[int, int]], int] = {}
+        # {(row, col, direction of travel): index of the lane leaving the junction}
+        self.outbound_lanes: Dict[Tuple[int, int, Tuple[int, int]], int] = {}
+        # {(row, col, direction in, direction out): road indexes crossing the junction}
+        self.connectors: Dict[Tuple[int, int, Tuple[int, int], Tuple[int, int]], List[int]] = {}
+        self.intersections: Dict[int, Set[int]] = {}
+
+        self._build_lanes()
+        for row in range(n_rows):
+            for col in range(n_cols):
+                self._build_junction(row, col)
+
+    def _centre(self, row: int, col: int) -> Tuple[float, float]:
+        return col * self._spacing, row * self._spacing
+
+    def _inbound_end(self, row: int, col: int, direction: Tuple[int, int]) -> Tuple[float, float]:
+        """ Where a lane travelling in the given direction reaches the junction box """
+        (x, y), (dx, dy), (rx, ry) = self._centre(row, col), direction, _right(direction)
+        return (x - dx * self._half_size + rx * self._lane_offset,
+                y - dy * self._half_size + ry * self._lane_offset)
+
+    def _outbound_start(self, row: int, col: int, direction: Tuple[int, int]) -> Tuple[float, float]:
+        """ Where a lane travelling in the given direction leaves the junction box """
+        (x, y), (dx, dy), (rx, ry) = self._centre(row, col), direction, _right(direction)
+        return (x + dx * self._half_size + rx * self._lane_offset,
+                y + dy * self._half_size + ry * self._lane_offset)
+
+    def _add_road(self, start, end) -> int:
+        self.roads.append((start, end))
+        return len(self.roads) - 1
+
+    def _in_grid(self, row: int, col: int) -> bool:
+        return 0 <= row < self.n_rows and 0 <= col < self.n_cols
+
+    def _build_lanes(self) -> None:
+        """ Adds the lanes between neighbouring junctions, and the perimeter entry and exit lanes """
+        for row in range(self.n_rows):
+            for col in range(self.n_cols):
+                for direction in DIRECTIONS:
+                    next_row, next_col = row + direction[1], col + direction[0]
+                    start = self._outbound_start(row, col, direction)
+                    if self._in_grid(next_row, next_col):
+                        end = self._inbound_end(next_row, next_col, direction)
+                        lane = self._add_road(start, end)
+                        self.inbound_lanes[next_row, next_col, direction] = lane
+                    else:
+                        # Exit lane
+                        end = (start[0] + direction[0] * self._approach_length,
+                               start[1] + direction[1] * self._approach_length)
+                        lane = self._add_road(start, end)
+                    self.outbound_lanes[row, col, direction] = lane
+
+                    # Entry lane, arriving from outside the grid in the opposite direction
+                    if not self._in_grid(next_row, next_col):
+                        opposite = (-direction[0], -direction[1])
+                        end = self._inbound_end(row, col, opposite)
+                        start = (end[0] + direction[0] * self._approach_length,
+                                 end[1] + direction[1] * self._approach_length)
+                        self.inbound_lanes[row, col, opposite] = self._add_road(start, end)
+
+    def _build_junction(self, row: int, col: int) -> None:
+        junction_roads: List[int] = []
+        for direction_in in DIRECTIONS:
+            start = self._inbound_end(row, col, direction_in)
+            for direction_out in (direction_in, _right(direction_in), _left(direction_in)):
+                end = self._outbound_start(row, col, direction_out)
+                if direction_out == direction_in:
+                    segments = [(start, end)]
+                else:
+                    segments = self._turn(start, end, direction_in)
+                roads = [self._add_road(*segment) for segment in segments]
+                self.connectors[row, col, direction_in, direction_out] = roads
+                junction_roads.extend(roads)
+        self._add_conflicts(junction_roads)
+
+    def _turn(self, start, end, direction_in):
+        """ Returns the segments of a turn leaving start along direction_in. turn_road's left/right
+        depend on the quadrant of the turn, so keep the curve whose first segment best follows
+        the direction of travel """
+        def alignment(segments):
+            (x1, y1), (x2, y2) = segments[0]
+            return ((x2 - x1) * direction_in[0] + (y2 - y1) * direction_in[1]) / hypot(x2 - x1, y2 - y1)
+
+        return max((turn_road(start, end, turn_direction, resolution=self._turn_resolution)
+                    for turn_direction in (TURN_LEFT, TURN_RIGHT)), key=alignment)
+
+    def _add_conflicts(self, junction_roads: List[int]) -> None:
+        """ Marks as intersecting the junction roads that cross or merge. Roads diverging from the
+        same lane don't conflict, since their vehicles come from the same queue """
+        for n, i in enumerate(junction_roads):
+            for j in junction_roads[n + 1:]:
+                (p1, p2), (q1, q2) = self.roads[i], self.roads[j]
+                if p1 == q1 or p2 == q1 or q2 == p1:
+                    # Same start, or consecutive segments of a turn
+                    continue
+                if _segments_intersect(p1, p2, q1, q2):
+                    self.intersections.setdefault(i, set()).add(j)
+                    self.intersections.setdefault(j, set()).add(i)
+
+    def route(self, row: int, col: int, direction: Tuple[int, int], turns: Dict[int, int] = None) -> List[int]:
+        """
+        Returns the road indexes of a route entering junction (row, col) in the given direction,
+        going straight until it leaves the grid, except at the junctions where it turns
+        :param turns: {junction number along the route: TURN_LEFT or TURN_RIGHT}
+        """
+        turns = turns or {}
+        path = [self.inbound_lanes[row, col, direction]]
+        n = 0
+        while self._in_grid(row, col):
+            direction_out = direction
+            if n in turns:
+                direction_out = _left(direction) if turns[n] == TURN_LEFT else _right(direction)
+            path.extend(self.connectors[row, col, direction, direction_out])
+            path.append(self.outbound_lanes[row, col, direction_out])
+            direction = direction_out
+            row, col = row + direction[1], col + direction[0]
+            n += 1
+        return path
+
+    def entry_points(self) -> List[Tuple[int, int, Tuple[int, int]]]:
+        """ Returns the (row, col, direction of travel) of the perimeter entry lanes """
+        return [key for key in self.inbound_lanes
+                if not self._in_grid(key[0] - key[2][1], key[1] - key[2][0])]
+
+    def signal_groups(self, row: int, col: int) -> List[List[int]]:
+        """ Returns the inbound lanes of the junction, one group per SIGNAL_GROUP_DIRECTIONS direction """
+        return [[self.inbound_lanes[row, col, direction]] for direction in SIGNAL_GROUP_DIRECTIONS]
+
+
+def build_grid(n_rows: int, n_cols: int, demand: float, straight_weight: int = 3, turn_weight: int = 1,
+               cycle: Optional[List[Tuple]] = None, durations: Optional[List[float]] = None,
+               slow_distance: float = 50, slow_factor: float = 0.4,
+               stop_distance: float = 15, max_gen: Optional[int] = None, dt: float = 1 / 60,
+               n_workers: Optional[int] = None, **geometry) -> Simulation:
+    """
+    Builds a simulation of a n_rows x n_cols city grid, with a traffic signal at every junction and
+    a vehicle generator on every perimeter entry lane
+    :param demand: vehicles per minute generated at each entry lane
+    :param straight_weight: weight of the route crossing the grid straight
+    :param turn_weight: weight of each route turning left or right at the first junction
+    :param cycle: traffic signals cycle. Each phase holds 4 states, one per approach group in the
+    SIGNAL_GROUP_DIRECTIONS order. Defaults to a protected green per approach, since vehicles don't
+    yield to conflicting movements
+    :param durations: seconds of each phase of the cycle. Defaults to DEFAULT_DURATIONS with the
+    default cycle, and to no fixed-time plan (externally switched signals) with a custom cycle
+    :param dt: simulation time step
+    :param n_workers: number of threads the roads are updated in (see Simulation)
+    :param geometry: GridScenario keyword arguments (spacing, junction_size, ...)
+    """
+    scenario = GridScenario(n_rows, n_cols, **geometry)
+    sim = Simulation(max_gen=max_gen, dt=dt, n_workers=n_workers)
+    sim.add_traffic_controllers(scenario.roads)
+    sim.add_intersections(scenario.intersections)
+
+    if cycle is None:
+        cycle, durations = DEFAULT_CYCLE, durations or DEFAULT_DURATIONS
+    for row in range(n_rows):
+        for col in range(n_cols):
+            sim.add_traffic_signal(scenario.signal_groups(row, col), list(cycle),
+                                   slow_distance, slow_factor, stop_distance)
+            if durations:
+                sim.set_signal_plan(len(sim.traffic_signals) - 1, list(cycle), list(durations))
+
+    for row, col, direction in scenario.entry_points():
+        paths = [[straight_weight, scenario.route(row, col, direction)]]
+        if turn_weight:
+            paths += [[turn_weight, scenario.route(row, col, direction, {0: turn})]
+                      for turn in (TURN_LEFT, TURN_RIGHT)]
+        sim.add_generator(demand, paths)
+    return sim
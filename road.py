@@ -32,6 +32,11 @@ class Road(Agent):
         self.has_traffic_signal: bool = False
         self.traffic_signal: Optional[TrafficSignal] = None
         self.traffic_signal_group: Optional[int] = None
+        # Red signal zones, as positions along the road. Set with the traffic signal
+        self._stop_zone_start: float = 0
+        self._stop_safely_limit: float = 0
+        # Generation index of the lead that was given the red signal orders, None while green
+        self._red_lead_index: Optional[int] = None
 
     async def setup(self):
         # Define a behavior to perceive and interact with the environment
@@ -65,6 +70,8 @@ class Road(Agent):
         self.has_traffic_signal = True
         self.traffic_signal = signal
         self.traffic_signal_group = group
+        self._stop_zone_start = self.length - signal.stop_distance
+        self._stop_safely_limit = self.length - signal.stop_distance / 1.5
 
     def __str__(self):
         return f'Road {self.index}'
@@ -82,21 +89,26 @@ class Road(Agent):
         if n > 0:
             lead: Vehicle = self.vehicles[0]
 
-            # Check for traffic signal
-            if self.traffic_signal_state:
-                # If traffic signal is green (or doesn't exist), let vehicles pass
-                self.notify_vehicle_to_start(sim_t, lead)
-
-            elif self.has_traffic_signal:
-                # The traffic signal is red (existence checked to access its stop_distance)
-                lead_can_stop_safely = lead.x <= self.length - self.traffic_signal.stop_distance / 1.5
-                # This check is to ensure that we don't stop vehicles that are too close to the traffic
-                # signal when it turns to yellow. In such a case, the vehicle should pass as quickly as possible,
-                # without being even slowed down
-                if lead_can_stop_safely:
-                    lead.slow(self.traffic_signal.slow_factor)  # slow vehicles in slow zone
-                    lead_in_stop_zone = self.length - self.traffic_signal.stop_distance <= lead.x
-                    if lead_in_stop_zone:
+            # While the traffic signal is green (or doesn't exist) there's nothing to do: the vehicles
+            # were notified to start when it turned green (see notify_vehicles_to_start)
+            if self.has_traffic_signal and not self.traffic_signal_state:
+                # The traffic signal is red
+                if lead.index != self._red_lead_index:
+                    # The signal just turned red, or the lead just changed: give the lead its orders once
+                    self._red_lead_index = lead.index
+                    lead_can_stop_safely = lead.x <= self._stop_safely_limit
+                    # This check is to ensure that we don't stop vehicles that are too close to the traffic
+                    # signal when it turns to yellow. In such a case, the vehicle should pass as quickly as possible,
+                    # without being even slowed down
+                    if lead_can_stop_safely:
+                        lead.slow(self.traffic_signal.slow_factor)  # slow vehicles in slow zone
+                        lead_in_stop_zone = self._stop_zone_start <= lead.x
+                        if lead_in_stop_zone:
+                            lead.stop(sim_t)
+                else:
+                    # A slowed lead stops upon entering the stop zone, even if its last step went past it
+                    x0, x1 = lead.step_offsets(self)
+                    if x0 < self._stop_zone_start <= x1:
                         lead.stop(sim_t)
 
             # Update first vehicle
@@ -106,8 +118,27 @@ class Road(Agent):
                 lead = self.vehicles[i - 1]
                 self.vehicles[i].update(lead, dt, self)
 
-    def notify_vehicle_to_start(self, sim_t, lead):
-        #print('Go!')
-        lead.unstop(sim_t)
+    def notify_vehicles_to_start(self, sim_t):
+        """ Called once when the road's traffic signal turns green """
+        self._red_lead_index = None
         for vehicle in self.vehicles:
-            vehicle.unslow()
\ No newline at end of file
+            vehicle.unstop(sim_t)
+            vehicle.unslow()
+
+    def add_vehicle(self, vehicle: Vehicle) -> None:
+        """ Adds a vehicle at the back of the road """
+        self.vehicles.append(vehicle)
+        vehicle.road = self
+
+    def receive_vehicle(self, vehicle: Vehicle, sim_t) -> None:
+        """ Adds a vehicle coming from the previous road of its path """
+        self.add_vehicle(vehicle)
+        self.pass_vehicle(vehicle, sim_t)
+
+    def pass_vehicle(self, vehicle: Vehicle, sim_t) -> None:
+        """ Called for every vehicle entering the road, including those crossing it within a time step """
+        # A vehicle that couldn't stop at a red signal keeps its stop/slow orders, which the
+        # road's green signal (or its absence) cancels
+        if self.traffic_signal_state:
+            vehicle.unstop(sim_t)
+            vehicle.unslow()
@@ -0,0 +1,203 @@
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import product
+from math import inf
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from simulation import Simulation
+
+PRUNE_CHECK_INTERVAL = 10  # Simulation seconds between dominance checks of a running candidate
+
+
+class SignalPlan(NamedTuple):
+    cycle: List[Tuple]
+    durations: List[float]  # Simulation seconds spent in each phase of the cycle
+
+
+class SignalSearchSpace(NamedTuple):
+    cycles: List[List[Tuple]]  # Candidate phase cycles
+    phase_durations: Sequence[float]  # Candidate durations of the (non-clearance) phases
+    clearance_duration: float = 3  # Fixed duration of the all-red (yellow) phases
+
+
+class Evaluation(NamedTuple):
+    plan: Dict[int, SignalPlan]  # {traffic signal index: plan}
+    score: float  # Total waiting time over the horizon, inf if the candidate was discarded
+    collision_detected: bool
+    pruned: bool
+
+
+def evaluate_plan(scenario: Callable[[], Simulation], plan: Dict[int, SignalPlan], horizon: float,
+                  bound: float = inf, seed: int = 0) -> Evaluation:
+    """ Runs a headless simulation with the given fixed-time plan
+    :param scenario: picklable callable building a fresh simulation, e.g. a functools.partial of a scenario builder
+    :param plan: {traffic signal index: plan}, the signals not in the plan keep the scenario cycle
+    :param horizon: simulation seconds to run
+    :param bound: total waiting time above which the candidate is dominated and stopped early
+    :param seed: vehicle generation seed, shared by all the candidates for a fair comparison
+    """
+    np.random.seed(seed)
+    with scenario() as sim:
+        for index, signal_plan in plan.items():
+            sim.set_signal_plan(index, *signal_plan)
+
+        check_interval = max(1, round(PRUNE_CHECK_INTERVAL / sim.dt))
+        for step in range(1, round(horizon / sim.dt) + 1):
+            sim.update()
+            if sim.collision_detected:
+                return Evaluation(plan, inf, True, False)
+            if sim.completed:
+                break
+            # The total waiting time never decreases, so once above the bound the candidate can't recover
+            if step % check_interval == 0 and sim.total_wait_time > bound:
+                return Evaluation(plan, inf, False, True)
+        return Evaluation(plan, sim.total_wait_time, False, False)
+
+
+class SignalTimingOptimizer:
+    def __init__(self, scenario: Callable[[], Simulation], search_space: Dict[int, SignalSearchSpace],
+                 horizon: float = 600, n_workers: Optional[int] = None, seed: int = 0,
+                 prune_margin: float = 0.1):
+        """
+        Searches fixed-time signal plans by running many headless simulations in a process pool
+        :param scenario: picklable callable building a fresh simulation
+        :param search_space: {traffic signal index: its search space}
+        :param horizon: simulation seconds each candidate runs for
+        :param n_workers: number of worker processes, defaults to the number of CPUs
+        :param seed: vehicle generation seed of every simulation
+        :param prune_margin: candidates exceeding the best score by this fraction are stopped early
+        """
+        self._scenario = scenario
+        self._search_space: Dict[int, SignalSearchSpace] = search_space
+        self._horizon: float = horizon
+        self._n_workers: Optional[int] = n_workers
+        self._seed: int = seed
+        self._prune_margin: float = prune_margin
+        self._rng = random.Random(seed)
+
+        self.best: Optional[Evaluation] = None
+        self.n_evaluated: int = 0
+        self.n_pruned: int = 0
+        self.n_collisions: int = 0
+
+    @property
+    def best_plan(self) -> Optional[Dict[int, SignalPlan]]:
+        """ Returns the best plan found so far per traffic signal """
+        return self.best.plan if self.best else None
+
+    @property
+    def _bound(self) -> float:
+        return self.best.score * (1 + self._prune_margin) if self.best else inf
+
+    def grid_search(self) -> Optional[Evaluation]:
+        """ Evaluates every combination of cycles and phase durations of every signal. Returns the best
+        evaluation so far, None if every candidate collided or was pruned """
+        per_signal = [list(self._signal_grid(space)) for space in self._search_space.values()]
+        plans = (dict(zip(self._search_space, combination)) for combination in product(*per_signal))
+        return self._evaluate_all(plans)
+
+    def random_search(self, n_candidates: int) -> Optional[Evaluation]:
+        """ Evaluates n_candidates plans sampled uniformly from the search space. Returns the best
+        evaluation so far, None if every candidate collided or was pruned """
+        return self._evaluate_all(self._random_plan() for _ in range(n_candidates))
+
+    def evolutionary_search(self, population_size: int = 16, n_generations: int = 10,
+                            mutation_rate: float = 0.2) -> Optional[Evaluation]:
+        """ Evolves a population of plans: the best half survives, and breeds the other half
+        by crossover of whole signal plans and mutation of phase durations. Returns the best
+        evaluation so far, None if every candidate collided or was pruned """
+        with ProcessPoolExecutor(max_workers=self._n_workers) as executor:
+            # Simulations are deterministic given the seed, so the survivors are not evaluated again
+            evaluations = self._evaluate_population(executor, (self._random_plan() for _ in range(population_size)))
+            n_parents = max(2, population_size // 2)
+            for _ in range(n_generations):
+                parents = sorted(evaluations, key=lambda evaluation: evaluation.score)[:n_parents]
+                children = []
+                while len(parents) + len(children) < population_size:
+                    a, b = self._rng.sample(parents, 2)
+                    children.append(self._mutate(self._crossover(a.plan, b.plan), mutation_rate))
+                evaluations = parents + self._evaluate_population(executor, children)
+        return self.best
+
+    def _evaluate_all(self, plans: Iterable[Dict[int, SignalPlan]]) -> Optional[Evaluation]:
+        with ProcessPoolExecutor(max_workers=self._n_workers) as executor:
+            self._evaluate_population(executor, plans)
+        return self.best
+
+    def _evaluate_population(self, executor: ProcessPoolExecutor,
+                             plans: Iterable[Dict[int, SignalPlan]]) -> List[Evaluation]:
+        """ Evaluates the plans in the process pool, keeping a bounded number of candidates in flight
+        so that each one is submitted with the tightest dominance bound known at the time """
+        evaluations: List[Evaluation] = []
+        plans: Iterator[Dict[int, SignalPlan]] = iter(plans)
+        max_in_flight = 2 * (self._n_workers or os.cpu_count() or 1)
+        in_flight: Set[Future] = set()
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                plan = next(plans, None)
+                if plan is None:
+                    exhausted = True
+                else:
+                    in_flight.add(executor.submit(evaluate_plan, self._scenario, plan, self._horizon,
+                                                  self._bound, self._seed))
+            if in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    evaluations.append(self._record(future.result()))
+        return evaluations
+
+    def _record(self, evaluation: Evaluation) -> Evaluation:
+        self.n_evaluated += 1
+        self.n_pruned += evaluation.pruned
+        self.n_collisions += evaluation.collision_detected
+        if evaluation.score < inf and (not self.best or evaluation.score < self.best.score):
+            self.best = evaluation
+        return evaluation
+
+    @staticmethod
+    def _is_clearance(phase: Tuple) -> bool:
+        return not any(phase)
+
+    def _durations(self, cycle: List[Tuple], space: SignalSearchSpace,
+                   choose: Callable[[], float]) -> List[float]:
+        return [space.clearance_duration if self._is_clearance(phase) else choose() for phase in cycle]
+
+    def _signal_grid(self, space: SignalSearchSpace) -> Iterator[SignalPlan]:
+        for cycle in space.cycles:
+            n_phases = sum(not self._is_clearance(phase) for phase in cycle)
+            for durations in product(space.phase_durations, repeat=n_phases):
+                choices = iter(durations)
+                yield SignalPlan(cycle, self._durations(cycle, space, lambda: next(choices)))
+
+    def _random_signal_plan(self, space: SignalSearchSpace) -> SignalPlan:
+        cycle = self._rng.choice(space.cycles)
+        return SignalPlan(cycle, self._durations(cycle, space, lambda: self._rng.choice(space.phase_durations)))
+
+    def _random_plan(self) -> Dict[int, SignalPlan]:
+        return {index: self._random_signal_plan(space) for index, space in self._search_space.items()}
+
+    def _crossover(self, a: Dict[int, SignalPlan], b: Dict[int, SignalPlan]) -> Dict[int, SignalPlan]:
+        return {index: (a if self._rng.random() < 0.5 else b)[index] for index in self._search_space}
+
+    def _mutate(self, plan: Dict[int, SignalPlan], mutation_rate: float) -> Dict[int, SignalPlan]:
+        mutated = {}
+        for index, (cycle, durations) in plan.items():
+            space = self._search_space[index]
+            if len(space.cycles) > 1 and self._rng.random() < mutation_rate:
+                mutated[index] = self._random_signal_plan(space)
+                continue
+            choices = sorted(space.phase_durations)
+            new_durations = list(durations)
+            for i, phase in enumerate(cycle):
+                if self._is_clearance(phase) or self._rng.random() >= mutation_rate:
+                    continue
+                # Move the phase duration to a neighbouring choice
+                j = min(range(len(choices)), key=lambda k: abs(choices[k] - durations[i]))
+                j = min(max(j + self._rng.choice((-1, 1)), 0), len(choices) - 1)
+                new_durations[i] = choices[j]
+            mutated[index] = SignalPlan(cycle, new_durations)
+        return mutated
@@ -1,18 +1,85 @@
-from itertools import chain
-from typing import List, Dict, Tuple, Set, Optional
-
-from scipy.spatial import distance
-
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from math import hypot, inf
+from typing import Iterable, Iterator, List, Dict, Tuple, Set, Optional
+
+from demand_profile import DemandProfile
+from event_scheduler import EventScheduler
 from traffic_controller import TrafficController
 from traffic_signal import TrafficSignal
+from vehicle import Vehicle
 from vehicle_generator import VehicleGenerator
+from vehicle_pool import VehiclePool
 from window import Window
 
 
+COLLISION_RADIUS = 3  # Vehicles closer than this (between centres) collide
+NEAR_MISS_FACTOR = 2  # Near misses are checked with a conflict window this many times larger
+
+
+def _conflict_offsets(road_a, road_b) -> Tuple[float, float, float]:
+    """ Returns the offsets along each road of their closest points, and the distance between them.
+    Roads are straight, so there's a single conflict point per pair (parallel roads get the closest
+    point to the start of road_a) """
+    (ax, ay), (bx, by) = road_a.start, road_b.start
+    ux, uy, la = road_a.angle_cos, road_a.angle_sin, road_a.length
+    vx, vy, lb = road_b.angle_cos, road_b.angle_sin, road_b.length
+    wx, wy = ax - bx, ay - by
+    # Closest points of two segments of unit directions u and v (Ericson, Real-Time Collision Detection)
+    uv, uw, vw = ux * vx + uy * vy, ux * wx + uy * wy, vx * wx + vy * wy
+    denominator = 1 - uv * uv
+    s = min(max((uv * vw - uw) / denominator, 0), la) if denominator > 1e-12 else 0
+    t = uv * s + vw
+    if t < 0:
+        t, s = 0, min(max(-uw, 0), la)
+    elif t > lb:
+        t, s = lb, min(max(uv * lb - uw, 0), la)
+    return s, t, hypot(ax + ux * s - bx - vx * t, ay + uy * s - by - vy * t)
+
+
+def _conflict_span(x0: float, x1: float, offset: float, window: float) -> Optional[Tuple[float, float]]:
+    """ Returns the fraction of the last time step during which a vehicle moving from x0 to x1 was
+    within the window around the conflict offset, assuming a constant speed along the step.
+    None if it wasn't """
+    low, high = offset - window, offset + window
+    if x0 == x1:
+        return (0, 1) if low < x0 < high else None
+    start, end = (low - x0) / (x1 - x0), (high - x0) / (x1 - x0)
+    if start > end:
+        start, end = end, start
+    start, end = max(start, 0), min(end, 1)
+    return (start, end) if start < end else None
+
+
+def _min_separation(da0: float, da1: float, db0: float, db1: float, cos: float, start: float, end: float) -> float:
+    """ Returns the minimum of da² + db² - 2·da·db·cos over the [start, end] fraction of the last time
+    step, da and db being the offsets of two vehicles from the conflict point of roads crossing at an
+    angle of the given cosine, moving at constant speeds along the step. Added to the squared gap
+    between the roads, it's the squared distance between the vehicles """
+    qa, qb = da1 - da0, db1 - db0
+    a = qa * qa + qb * qb - 2 * cos * qa * qb
+    b = 2 * (da0 * qa + db0 * qb - cos * (da0 * qb + db0 * qa))
+    c = da0 * da0 + db0 * db0 - 2 * cos * da0 * db0
+    # The quadratic is convex, so its minimum over the span is at its vertex or at an end
+    tau = min(max(-b / (2 * a), start), end) if a > 0 else (start if b > 0 else end)
+    return (a * tau + b) * tau + c
+
+
 class Simulation:
-    def __init__(self, max_gen: int = None):
+    def __init__(self, max_gen: int = None, dt: float = 1 / 60, n_workers: Optional[int] = None):
+        """
+        :param max_gen: vehicle generation limit
+        :param dt: time step. Collisions are checked along each step, including the steps in which
+        vehicles change road, so steps of 0.1-0.25 s are safe for experiments where a smooth
+        animation doesn't matter
+        :param n_workers: number of threads the roads are updated in. Threads only speed the updates
+        up on free-threaded Python builds: with the GIL, any number above 1 makes them slower. Defaults
+        to the number of CPUs on free-threaded builds, and to 1 (no threads) otherwise. With more than
+        1 worker, call close() or use the simulation as a context manager to stop the threads
+        """
         self.t = 0.0  # Time
-        self.dt = 1 / 60  # Time step
+        self.dt = dt  # Time step
         self.traffic_controllers: List[TrafficController] = []
         self.generators: List[VehicleGenerator] = []
         self.traffic_signals: List[TrafficSignal] = []
@@ -30,11 +97,55 @@ class Simulation:
         self._outbound_roads: Set[int] = set()
 
         self._intersections: Dict[int, Set[int]] = {}  # {TrafficController index: [intersecting roads' indexes]}
+        # {road index: {intersecting road index: (road offset, intersecting road offset, window)}}
+        self._conflict_points: Dict[int, Dict[int, Tuple[float, float, float]]] = {}
+        self.n_near_misses: int = 0
+        self._near_misses: Set[Tuple[int, int]] = set()  # Vehicle index pairs in a near miss
+
+        # Vehicles that left the map are recycled, and the vehicles on the same path share it
+        self._vehicle_pool: VehiclePool = VehiclePool()
+        self.paths: List[Tuple[int, ...]] = []  # Interned paths, indexed by path id
+        self._path_ids: Dict[Tuple[int, ...], int] = {}
+        # Buffers reused on every update
+        self._new_non_empty_roads: Set[int] = set()
+        self._new_empty_roads: Set[int] = set()
+        self._near_misses_buffer: Set[Tuple[int, int]] = set()
+        # (vehicle, start offset, end offset) of the vehicles that left each road along the last time
+        # step, so that collisions along that step are still detected, and the roads they left
+        self._exit_sweeps: List[List[Tuple[Vehicle, float, float]]] = []
+        self._exit_roads: Set[int] = set()
+
+        if n_workers is None:
+            gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+            n_workers = 1 if gil_enabled else os.cpu_count() or 1
+        self._n_workers: int = n_workers
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(n_workers) if n_workers > 1 else None
         self.max_gen: Optional[int] = max_gen  # Vehicle generation limit
         self._waiting_times_sum: float = 0  # for vehicles that completed the journey
 
+        # Generators and fixed-time signals register their next due time, so that each update
+        # only touches the due ones
+        self._scheduler: EventScheduler = EventScheduler()
+        self._generator_handles: List[int] = []
+        self._signal_handles: List[int] = []
+        self._demand_profiles: List[DemandProfile] = []
+
     def add_intersections(self, intersections_dict: Dict[int, Set[int]]) -> None:
+        """ Adds the intersecting roads, which must already exist, and precomputes their conflict
+        points: the offsets along each road where vehicles come closer than the collision radius.
+        Intersecting roads that never come that close have no conflict point """
         self._intersections.update(intersections_dict)
+        for i, intersecting_roads in intersections_dict.items():
+            for j in intersecting_roads:
+                road_a, road_b = self.traffic_controllers[i], self.traffic_controllers[j]
+                s, t, gap = _conflict_offsets(road_a, road_b)
+                if gap < COLLISION_RADIUS:
+                    # Half width of the offsets window in which both vehicles can be too close, and
+                    # the cosine of the crossing angle, which tells how close within that window
+                    window = (COLLISION_RADIUS ** 2 - gap ** 2) ** 0.5
+                    cos = road_a.angle_cos * road_b.angle_cos + road_a.angle_sin * road_b.angle_sin
+                    self._conflict_points.setdefault(i, {})[j] = (s, t, window, cos)
+                    self._conflict_points.setdefault(j, {})[i] = (t, s, window, cos)
 
     def add_traffic_controller(self, start: Tuple[int, int], end: Tuple[int, int]) -> None:
         traffic_controller = TrafficController(
@@ -42,6 +153,7 @@ class Simulation:
         )
         #await traffic_controller.start(auto_register=True)
         self.traffic_controllers.append(traffic_controller)
+        self._exit_sweeps.append([])
 
     def add_traffic_controllers(self, traffic_controllers: List[Tuple[int, int]]) -> None:
         for traffic_controller in traffic_controllers:
@@ -52,19 +164,62 @@ class Simulation:
         inbound_dict: Dict[int: TrafficController] = {
             traffic_controller.index: traffic_controller for traffic_controller in inbound_roads
         }
-        vehicle_generator = VehicleGenerator(vehicle_rate, paths, inbound_dict)
+        weighted_path_ids = [(weight, self._intern_path(roads)) for weight, roads in paths]
+        vehicle_generator = VehicleGenerator(vehicle_rate, weighted_path_ids, inbound_dict,
+                                             self.paths, self._vehicle_pool)
         self.generators.append(vehicle_generator)
+        self._generator_handles.append(
+            self._scheduler.register(lambda t: self._on_generator_due(vehicle_generator), self.t))
 
         for (weight, roads) in paths:
             self._inbound_roads.add(roads[0])
             self._outbound_roads.add(roads[-1])
 
+    def _intern_path(self, roads: List[int]) -> int:
+        """ Returns the id of the path, adding it to the paths' table if new """
+        path = tuple(roads)
+        if path not in self._path_ids:
+            self._path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        return self._path_ids[path]
+
     def add_traffic_signal(self, traffic_controllers: List[List[int]], cycle: List[Tuple],
                            slow_distance: float, slow_factor: float, stop_distance: float) -> None:
         traffic_controllers: List[List[TrafficController]] = \
             [[self.traffic_controllers[i] for i in traffic_controller_group] for traffic_controller_group in traffic_controllers]
         traffic_signal = TrafficSignal(traffic_controllers, cycle, slow_distance, slow_factor, stop_distance)
         self.traffic_signals.append(traffic_signal)
+        self._signal_handles.append(
+            self._scheduler.register(lambda t: self._on_signal_due(traffic_signal), traffic_signal.next_switch_time))
+
+    def add_demand_profile(self, path: str) -> None:
+        """ Streams the generators' vehicle rates from a CSV schedule (see DemandProfile) """
+        demand_profile = DemandProfile(path)
+        self._demand_profiles.append(demand_profile)
+        # Rate changes apply before the generations due at the same time
+        self._scheduler.register(lambda t: self._on_demand_change_due(demand_profile), demand_profile.next_time,
+                                 priority=-1)
+
+    def set_signal_plan(self, index: int, cycle: List[Tuple], durations: Optional[List[float]] = None) -> None:
+        """ Replaces the cycle of a traffic signal. With durations, the signal switches on its own """
+        traffic_signal = self.traffic_signals[index]
+        traffic_signal.set_plan(cycle, durations, self.t)
+        traffic_signal.prev_update_time = self.t
+        self._scheduler.reschedule(self._signal_handles[index], traffic_signal.next_switch_time)
+
+    def switch_signal(self, index: int, phase_index: Optional[int] = None) -> None:
+        """ Switches a traffic signal at the current time. A fixed-time signal then spends the full
+        duration of the new phase in it
+        :param index: traffic signal index
+        :param phase_index: index of the phase in the signal cycle, the next phase if None
+        """
+        traffic_signal = self.traffic_signals[index]
+        if phase_index is None:
+            traffic_signal.update(self.t)
+        else:
+            traffic_signal.set_phase(phase_index, self.t)
+        traffic_signal.prev_update_time = self.t
+        self._scheduler.reschedule(self._signal_handles[index], traffic_signal.next_switch_time)
 
     @property
     def gui_closed(self) -> bool:
@@ -117,6 +272,14 @@ class Simulation:
             on_map_wait_time = total_on_map_wait_time / self.n_vehicles_on_map
         return completed_wait_time + on_map_wait_time
 
+    @property
+    def total_wait_time(self) -> float:
+        """ Returns the waiting time accumulated so far by all the generated vehicles.
+        Unlike the average, it never decreases along an episode """
+        on_map_wait_time = sum(vehicle.get_wait_time(self.t) for i in self.non_empty_roads
+                               for vehicle in self.traffic_controllers[i].vehicles)
+        return self._waiting_times_sum + on_map_wait_time
+
     @property
     def inbound_roads(self) -> Set[int]:
         return self._inbound_roads
@@ -133,7 +296,7 @@ class Simulation:
 
     async def run_agents(self, action: Optional[int] = None) -> None:
         """ Executa um passo de simulação para todos os agentes """
-        n = 180  # 3 simulation seconds
+        n = round(3 / self.dt)  # 3 simulation seconds
         if action:
             await self.update_agents()
             await self._detect_collisions()
@@ -147,7 +310,7 @@ class Simulation:
         """ Performs n simulation updates. Terminates early upon completion or GUI closing
         :param action: an action from a reinforcement learning environment action space
         """
-        n = 180  # 3 simulation seconds
+        n = round(3 / self.dt)  # 3 simulation seconds
         if action:
             self._update_signals()
             self._loop(n)
@@ -160,19 +323,18 @@ class Simulation:
 
     def update(self) -> None:
         """ Updates the roads, generates vehicles, detect collisions and updates the gui """
-        # Update every road
-        for i in self._non_empty_roads:
-            self.traffic_controllers[i].update(self.dt, self.t)
-
-        # Add vehicles
-        for gen in self.generators:
-            if self.max_gen and self.n_vehicles_generated == self.max_gen:
-                break
-            road_index = gen.update(self.t, self.n_vehicles_generated)
-            if road_index is not None:
-                self.n_vehicles_generated += 1
-                self.n_vehicles_on_map += 1
-                self._non_empty_roads.add(road_index)
+        # Update every road. Roads only touch their own vehicles, so they can be updated in parallel.
+        # Handoffs between roads and collisions are handled afterwards, in a single thread
+        if self._executor:
+            roads = sorted(self._non_empty_roads)
+            partitions = [roads[k::self._n_workers] for k in range(self._n_workers)]
+            for _ in self._executor.map(self._update_roads, partitions):
+                pass
+        else:
+            self._update_roads(self._non_empty_roads)
+
+        # Add vehicles, switch fixed-time signals and apply demand changes that are due
+        self._scheduler.run_due(self.t)
 
         self._check_out_of_bounds_vehicles()
 
@@ -185,6 +347,24 @@ class Simulation:
         if self._gui:
             self._gui.update()
 
+    def _update_roads(self, roads: Iterable[int]) -> None:
+        for i in roads:
+            self.traffic_controllers[i].update(self.dt, self.t)
+
+    def close(self) -> None:
+        """ Stops the road update threads, if any, and closes the demand profiles """
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+        for demand_profile in self._demand_profiles:
+            demand_profile.close()
+
+    def __enter__(self) -> 'Simulation':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
     def _loop(self, n: int) -> None:
         """ Performs n simulation updates. Terminates early upon completion or GUI closing"""
         for _ in range(n):
@@ -194,57 +374,159 @@ class Simulation:
 
     def _update_signals(self) -> None:
         """ Updates all the simulation traffic signals and updates the gui, if exists """
-        for traffic_signal in self.traffic_signals:
-            traffic_signal.update()
+        for index in range(len(self.traffic_signals)):
+            self.switch_signal(index)
         if self._gui:
             self._gui.update()
 
+    def _on_generator_due(self, generator: VehicleGenerator) -> Optional[float]:
+        """ Generates a vehicle if possible. Returns the time of the next generation attempt """
+        if self.max_gen and self.n_vehicles_generated == self.max_gen:
+            return None
+        road_index = generator.update(self.t, self.n_vehicles_generated)
+        if road_index is not None:
+            self.n_vehicles_generated += 1
+            self.n_vehicles_on_map += 1
+            self._non_empty_roads.add(road_index)
+        # If the inbound road had no space, try again on the next update
+        next_generation_time = generator.next_generation_time
+        return max(next_generation_time, self.t) if next_generation_time < inf else None
+
+    def _on_signal_due(self, traffic_signal: TrafficSignal) -> Optional[float]:
+        """ Advances a fixed-time signal whose current phase has elapsed """
+        switch_time = traffic_signal.next_switch_time
+        if switch_time is None:
+            return None
+        traffic_signal.update(self.t)
+        # Anchor on the scheduled time so that phases don't drift by a time step per switch
+        traffic_signal.prev_update_time = switch_time
+        return traffic_signal.next_switch_time
+
+    def _on_demand_change_due(self, demand_profile: DemandProfile) -> Optional[float]:
+        """ Applies the due vehicle rate changes and reschedules the affected generators """
+        for generator_index, vehicle_rate in demand_profile.pop_due(self.t):
+            generator = self.generators[generator_index]
+            generator.set_vehicle_rate(vehicle_rate)
+            next_generation_time = generator.next_generation_time
+            self._scheduler.reschedule(self._generator_handles[generator_index],
+                                       max(next_generation_time, self.t) if next_generation_time < inf else None)
+        return demand_profile.next_time
+
+    def _conflicting_road_pairs(self, roads: Set[int], other_roads: Set[int] = frozenset()) \
+            -> Iterator[Tuple[int, int, Tuple[float, float, float, float]]]:
+        """ Yields each pair of roads of either set with a conflict point once, with the conflict point """
+        for road_set in (roads, other_roads):
+            for i in road_set:
+                if road_set is other_roads and i in roads:
+                    continue
+                conflict_points = self._conflict_points.get(i)
+                if conflict_points:
+                    for j, conflict_point in conflict_points.items():
+                        if j > i and (j in roads or j in other_roads):
+                            yield i, j, conflict_point
+
+    def _road_sweeps(self, i: int) -> Iterator[Tuple[Vehicle, float, float]]:
+        """ Yields the (vehicle, start offset, end offset) of every vehicle on the road along the
+        last time step, including the vehicles that left it """
+        road = self.traffic_controllers[i]
+        for vehicle in road.vehicles:
+            yield (vehicle, *vehicle.step_offsets(road))
+        yield from self._exit_sweeps[i]
+
+    def time_to_conflicts(self) -> List[Tuple[int, int, float, float]]:
+        """
+        Returns the (vehicle index, intersecting vehicle index, time to conflict, intersecting time
+        to conflict) of every pair of vehicles approaching the conflict point of their roads,
+        at their current speeds. A stopped vehicle has an infinite time to conflict
+        """
+        output = []
+        for i, j, (s, t, window, cos) in self._conflicting_road_pairs(self._non_empty_roads):
+            approaching_b = [(vehicle.index, (t - vehicle.x) / vehicle.v if vehicle.v > 0 else inf)
+                             for vehicle in self.traffic_controllers[j].vehicles if vehicle.x <= t]
+            if not approaching_b:
+                continue
+            for a in self.traffic_controllers[i].vehicles:
+                if a.x <= s:
+                    time_a = (s - a.x) / a.v if a.v > 0 else inf
+                    output.extend((a.index, index_b, time_a, time_b) for index_b, time_b in approaching_b)
+        return output
+
     def _detect_collisions(self) -> None:
-        """ Detects collisions by checking all non-empty intersecting vehicle paths.
-        Updates the self.collision_detected attribute """
-        radius = 3
-        for main_road, intersecting_roads in self.intersections.items():
-            vehicles = self.traffic_controllers[main_road].vehicles
-            intersecting_vehicles = chain.from_iterable(
-                self.traffic_controllers[i].vehicles for i in intersecting_roads)
-            for vehicle in vehicles:
-                for intersecting in intersecting_vehicles:
-                    if distance.euclidean(vehicle.position, intersecting.position) < radius:
-                        self.collision_detected = True
-                        return
+        """ Detects collisions and near misses on the roads with conflict points that had vehicles
+        along the last time step. Two vehicles collide if, during the same part of the time step,
+        both were within the window of their offsets of the conflict point and closer than the
+        collision radius, so that large steps can't tunnel them through each other. Updates the
+        self.collision_detected and self.n_near_misses attributes """
+        near_misses = self._near_misses_buffer
+        near_misses.clear()
+        for i, j, (s, t, window, cos) in self._conflicting_road_pairs(self._non_empty_roads, self._exit_roads):
+            near_window = NEAR_MISS_FACTOR * window
+            near_b = [(b, x0, x1, span) for b, x0, x1 in self._road_sweeps(j)
+                      for span in (_conflict_span(x0, x1, t, near_window),) if span]
+            if not near_b:
+                continue
+            for a, ax0, ax1 in self._road_sweeps(i):
+                span_a = _conflict_span(ax0, ax1, s, near_window)
+                if not span_a:
+                    continue
+                for b, bx0, bx1, span_b in near_b:
+                    start, end = max(span_a[0], span_b[0]), min(span_a[1], span_b[1])
+                    if a is b or start >= end or \
+                            _min_separation(ax0 - s, ax1 - s, bx0 - t, bx1 - t, cos, start, end) >= near_window ** 2:
+                        continue
+                    collision_a = _conflict_span(ax0, ax1, s, window)
+                    collision_b = _conflict_span(bx0, bx1, t, window)
+                    if collision_a and collision_b:
+                        start, end = max(collision_a[0], collision_b[0]), min(collision_a[1], collision_b[1])
+                        if start < end and \
+                                _min_separation(ax0 - s, ax1 - s, bx0 - t, bx1 - t, cos, start, end) < window ** 2:
+                            self.collision_detected = True
+                            return
+                    near_misses.add((a.index, b.index))
+        # Count each near miss once, upon its first time step
+        self.n_near_misses += sum(pair not in self._near_misses for pair in near_misses)
+        self._near_misses, self._near_misses_buffer = near_misses, self._near_misses
 
     def _check_out_of_bounds_vehicles(self):
         """ Check roads for out-of-bounds vehicles, updates self.non_empty_roads """
-        new_non_empty_roads = set()
-        new_empty_roads = set()
+        new_non_empty_roads = self._new_non_empty_roads
+        new_empty_roads = self._new_empty_roads
+        new_non_empty_roads.clear()
+        new_empty_roads.clear()
+        for i in self._exit_roads:
+            self._exit_sweeps[i].clear()
+        self._exit_roads.clear()
         for i in self._non_empty_roads:
             road = self.traffic_controllers[i]
             lead = road.vehicles[0]
             # If first vehicle is out of road bounds
             if lead.x >= road.length:
-                # If vehicle has a next road
-                if lead.current_road_index + 1 < len(lead.path):
-                    # Remove it from its road
-                    road.vehicles.popleft()
-                    # Reset the position relative to the road
-                    lead.x = 0
-                    # Add it to the next road
-                    lead.current_road_index += 1
-                    next_road_index = lead.path[lead.current_road_index]
-                    new_non_empty_roads.add(next_road_index)
-                    self.traffic_controllers[next_road_index].vehicles.append(lead)
-                    # road.vehicles.popleft()
-                    if not road.vehicles:
-                        new_empty_roads.add(road.index)
+                # Remove it from its road
+                road.vehicles.popleft()
+                # Remove from non_empty_roads if it has no vehicles
+                if not road.vehicles:
+                    new_empty_roads.add(road.index)
+                self._exit_sweeps[i].append((lead, *lead.step_offsets(road)))
+                self._exit_roads.add(i)
+                # While the vehicle has a next road
+                while lead.current_road_index + 1 < len(lead.path):
+                    next_road = self.traffic_controllers[lead.path[lead.current_road_index + 1]]
+                    # Keep the distance travelled past the end of the road
+                    lead.change_road(next_road)
+                    if lead.x < next_road.length or next_road.vehicles:
+                        # Add it to the next road
+                        new_non_empty_roads.add(next_road.index)
+                        next_road.receive_vehicle(lead, self.t)
+                        break
+                    # The empty next road is shorter than the distance left to travel in the step
+                    next_road.pass_vehicle(lead, self.t)
+                    self._exit_sweeps[next_road.index].append((lead, *lead.step_offsets(next_road)))
+                    self._exit_roads.add(next_road.index)
                 else:
-                    # Remove it from its road
-                    road.vehicles.popleft()
-                    # Remove from non_empty_roads if it has no vehicles
-                    if not road.vehicles:
-                        new_empty_roads.add(road.index)
                     self.n_vehicles_on_map -= 1
                     # Update the waiting times sum
                     self._waiting_times_sum += lead.get_wait_time(self.t)
+                    self._vehicle_pool.release(lead)
 
         self._non_empty_roads.difference_update(new_empty_roads)
         self._non_empty_roads.update(new_non_empty_roads)
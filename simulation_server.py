@@ -0,0 +1,283 @@
+import os
+import selectors
+import socket
+import struct
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from simulation import Simulation
+
+# Observation buffer layout (float64): header, then the vehicles and the queue (stopped vehicles)
+# of every road, then the current phase index of every traffic signal
+SEQ, STEP, T, N_GENERATED, N_ON_MAP, COLLISION, AVERAGE_WAIT_TIME, N_ROADS, N_SIGNALS = range(9)
+HEADER_SIZE = 9
+
+# Requests: (n_ticks, n_actions) followed by n_actions (signal index, phase index) pairs, at most
+# one per traffic signal. A phase index of NEXT_PHASE advances the signal to its next phase, a
+# negative n_ticks stops the server. Replies: the step counter after the request was handled
+REQUEST = struct.Struct('<ii')
+ACTION = struct.Struct('<ii')
+REPLY = struct.Struct('<q')
+NEXT_PHASE = -1
+
+# Shared memory blocks of the servers of this process, which clients in it share the tracking of
+_served_blocks: Set[str] = set()
+
+
+class Observation(NamedTuple):
+    step: int
+    t: float
+    n_vehicles_generated: int
+    n_vehicles_on_map: int
+    collision_detected: bool
+    average_wait_time: float
+    road_vehicles: np.ndarray
+    road_queues: np.ndarray
+    signal_phases: np.ndarray
+
+
+def _recv_exactly(connection: socket.socket, n: int) -> Optional[bytes]:
+    """ Returns n bytes read from the connection, None if the peer closed it """
+    data = bytearray()
+    while len(data) < n:
+        chunk = connection.recv(n - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+class SimulationServer:
+    def __init__(self, sim: Simulation, socket_path: str, shm_name: Optional[str] = None,
+                 free_running: bool = False):
+        """
+        Serves a simulation to controllers running in other processes. Observations are published
+        into a shared memory buffer guarded by a sequence lock, actions are received in batches
+        over a Unix socket
+        :param socket_path: path of the Unix socket to listen on
+        :param shm_name: name of the shared memory block, generated if None
+        :param free_running: if True, the simulation steps continuously and actions are applied as
+        they arrive. Otherwise it only steps the number of ticks each request asks for
+        """
+        self._sim: Simulation = sim
+        self._free_running: bool = free_running
+        self._step: int = 0
+        self._running: bool = False
+
+        n_roads, n_signals = len(sim.traffic_controllers), len(sim.traffic_signals)
+        size = HEADER_SIZE + 2 * n_roads + n_signals
+        self._shm: Optional[SharedMemory] = SharedMemory(name=shm_name, create=True, size=size * 8)
+        _served_blocks.add(self._shm.name)
+        self._buffer = np.ndarray((size,), dtype=np.float64, buffer=self._shm.buf)
+        self._buffer[:] = 0
+        self._buffer[N_ROADS], self._buffer[N_SIGNALS] = n_roads, n_signals
+        self._road_vehicles = self._buffer[HEADER_SIZE:HEADER_SIZE + n_roads]
+        self._road_queues = self._buffer[HEADER_SIZE + n_roads:HEADER_SIZE + 2 * n_roads]
+        self._signal_phases = self._buffer[HEADER_SIZE + 2 * n_roads:]
+
+        self._socket_path: str = socket_path
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(socket_path)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._publish()
+
+    @property
+    def shm_name(self) -> str:
+        return self._shm.name
+
+    def _publish(self) -> None:
+        """ Writes the current observation. Readers retry while the sequence number is odd or changed """
+        sim, buffer = self._sim, self._buffer
+        buffer[SEQ] += 1
+        buffer[STEP] = self._step
+        buffer[T] = sim.t
+        buffer[N_GENERATED] = sim.n_vehicles_generated
+        buffer[N_ON_MAP] = sim.n_vehicles_on_map
+        buffer[COLLISION] = sim.collision_detected
+        buffer[AVERAGE_WAIT_TIME] = sim.current_average_wait_time
+        self._road_vehicles[:] = 0
+        self._road_queues[:] = 0
+        for i in sim.non_empty_roads:
+            vehicles = sim.traffic_controllers[i].vehicles
+            self._road_vehicles[i] = len(vehicles)
+            self._road_queues[i] = sum(vehicle.is_stopped for vehicle in vehicles)
+        self._signal_phases[:] = [traffic_signal.current_cycle_index for traffic_signal in sim.traffic_signals]
+        buffer[SEQ] += 1
+
+    def _valid_action(self, signal_index: int, phase_index: int) -> bool:
+        traffic_signals = self._sim.traffic_signals
+        if not 0 <= signal_index < len(traffic_signals):
+            return False
+        return phase_index == NEXT_PHASE or 0 <= phase_index < len(traffic_signals[signal_index].cycle)
+
+    def _apply_actions(self, actions: List[Tuple[int, int]]) -> None:
+        for signal_index, phase_index in actions:
+            self._sim.switch_signal(signal_index, None if phase_index == NEXT_PHASE else phase_index)
+
+    def _tick(self) -> None:
+        self._sim.update()
+        self._step += 1
+
+    def _drop(self, connection: socket.socket) -> None:
+        self._selector.unregister(connection)
+        connection.close()
+
+    def _receive(self, connection: socket.socket, pending: bytearray) -> None:
+        """ Reads what a controller sent, without blocking, and handles its complete requests. Partial
+        requests stay pending until the rest arrives. Drops the connection if the controller closed
+        it, or sent an invalid request, which is not applied """
+        try:
+            data = connection.recv(65536)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b''
+        if not data:
+            self._drop(connection)
+            return
+        pending.extend(data)
+        while self._running and len(pending) >= REQUEST.size:
+            n_ticks, n_actions = REQUEST.unpack_from(pending)
+            if not 0 <= n_actions <= len(self._sim.traffic_signals):
+                self._drop(connection)
+                return
+            size = REQUEST.size + n_actions * ACTION.size
+            if len(pending) < size:
+                return
+            actions = list(ACTION.iter_unpack(pending[REQUEST.size:size]))
+            del pending[:size]
+            if not all(self._valid_action(*action) for action in actions):
+                self._drop(connection)
+                return
+            try:
+                self._handle(connection, n_ticks, actions)
+            except (ConnectionError, BlockingIOError):
+                # Gone, or not reading its replies
+                self._drop(connection)
+                return
+
+    def _handle(self, connection: socket.socket, n_ticks: int, actions: List[Tuple[int, int]]) -> None:
+        """ Handles one request of a controller """
+        if n_ticks < 0:
+            self._running = False
+        else:
+            self._apply_actions(actions)
+            if not self._free_running:
+                for _ in range(n_ticks):
+                    if self._sim.completed:
+                        break
+                    self._tick()
+            self._publish()
+        connection.sendall(REPLY.pack(self._step))
+
+    def serve(self) -> None:
+        """ Serves requests until a controller asks to stop. In free running mode, the simulation
+        steps between requests until completion. Closes the server if serving fails """
+        self._running = True
+        try:
+            while self._running:
+                stepping = self._free_running and not self._sim.completed
+                # Don't block on the socket while the simulation has to keep stepping
+                for key, _ in self._selector.select(timeout=0 if stepping else None):
+                    if key.fileobj is self._listener:
+                        connection, _ = self._listener.accept()
+                        # A controller sending part of a request mustn't stall the others
+                        connection.setblocking(False)
+                        self._selector.register(connection, selectors.EVENT_READ, bytearray())
+                    else:
+                        self._receive(key.fileobj, key.data)
+                if stepping and self._running:
+                    self._tick()
+                    self._publish()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """ Closes the connections and removes the socket file and the shared memory block.
+        Does nothing if already closed """
+        if self._shm is None:
+            return
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        os.unlink(self._socket_path)
+        del self._road_vehicles, self._road_queues, self._signal_phases, self._buffer
+        self._shm.close()
+        self._shm.unlink()
+        _served_blocks.discard(self._shm.name)
+        self._shm = None
+
+
+class SimulationClient:
+    def __init__(self, socket_path: str, shm_name: str):
+        """ Controller side of a SimulationServer """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        # The server owns the block: it mustn't be unlinked when this process exits
+        if sys.version_info >= (3, 13):
+            self._shm = SharedMemory(name=shm_name, track=False)
+        else:
+            self._shm = SharedMemory(name=shm_name)
+            if shm_name not in _served_blocks:
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+        header = np.ndarray((HEADER_SIZE,), dtype=np.float64, buffer=self._shm.buf)
+        self._n_roads, self._n_signals = int(header[N_ROADS]), int(header[N_SIGNALS])
+        size = HEADER_SIZE + 2 * self._n_roads + self._n_signals
+        self._buffer = np.ndarray((size,), dtype=np.float64, buffer=self._shm.buf)
+        del header
+
+    def observe(self) -> Observation:
+        """ Returns a consistent copy of the latest published observation """
+        while True:
+            seq = self._buffer[SEQ]
+            if seq % 2:
+                continue
+            snapshot = self._buffer.copy()
+            if self._buffer[SEQ] == seq:
+                break
+        n_roads = self._n_roads
+        return Observation(
+            step=int(snapshot[STEP]),
+            t=float(snapshot[T]),
+            n_vehicles_generated=int(snapshot[N_GENERATED]),
+            n_vehicles_on_map=int(snapshot[N_ON_MAP]),
+            collision_detected=bool(snapshot[COLLISION]),
+            average_wait_time=float(snapshot[AVERAGE_WAIT_TIME]),
+            road_vehicles=snapshot[HEADER_SIZE:HEADER_SIZE + n_roads].astype(int),
+            road_queues=snapshot[HEADER_SIZE + n_roads:HEADER_SIZE + 2 * n_roads].astype(int),
+            signal_phases=snapshot[HEADER_SIZE + 2 * n_roads:].astype(int),
+        )
+
+    def _request(self, n_ticks: int, actions: Sequence[Tuple[int, int]]) -> int:
+        message = REQUEST.pack(n_ticks, len(actions)) + b''.join(ACTION.pack(*action) for action in actions)
+        self._socket.sendall(message)
+        reply = _recv_exactly(self._socket, REPLY.size)
+        if reply is None:
+            raise ConnectionError('The server closed the connection, the request may have been invalid')
+        return REPLY.unpack(reply)[0]
+
+    def step(self, actions: Sequence[Tuple[int, int]] = (), n_ticks: int = 1) -> int:
+        """
+        Sends a batch of actions, then (in synchronous mode) waits for the simulation to step
+        :param actions: (traffic signal index, phase index or NEXT_PHASE) pairs
+        :param n_ticks: simulation updates to run after applying the actions, ignored in free running mode
+        :return: the server step counter
+        """
+        return self._request(n_ticks, actions)
+
+    def shutdown(self) -> None:
+        """ Stops the server """
+        self._request(-1, ())
+
+    def close(self) -> None:
+        self._socket.close()
+        del self._buffer
+        self._shm.close()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from demand_profile import DemandProfile
+
+
+class DemandProfileTest(unittest.TestCase):
+    def _write_schedule(self, text: str) -> str:
+        file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        file.write(text)
+        file.close()
+        self.addCleanup(os.unlink, file.name)
+        return file.name
+
+    def test_skips_header_comments_and_blank_lines(self):
+        path = self._write_schedule('time,generator,rate\n# Morning peak\n\n0,0,10\n30,1,20\n')
+        demand_profile = DemandProfile(path)
+        self.addCleanup(demand_profile.close)
+        self.assertEqual(demand_profile.next_time, 0)
+        self.assertEqual(demand_profile.pop_due(0), [(0, 10)])
+        self.assertEqual(demand_profile.next_time, 30)
+
+    def test_header_is_optional(self):
+        demand_profile = DemandProfile(self._write_schedule('5,0,10\n'))
+        self.addCleanup(demand_profile.close)
+        self.assertEqual(demand_profile.next_time, 5)
+
+    def test_pops_every_change_due(self):
+        demand_profile = DemandProfile(self._write_schedule('0,0,10\n0,1,0\n10,0,5\n20,1,5\n'))
+        self.addCleanup(demand_profile.close)
+        self.assertEqual(demand_profile.pop_due(15), [(0, 10), (1, 0), (0, 5)])
+        self.assertEqual(demand_profile.pop_due(15), [])
+        self.assertEqual(demand_profile.pop_due(20), [(1, 5)])
+
+    def test_closes_the_file_once_exhausted(self):
+        demand_profile = DemandProfile(self._write_schedule('0,0,10\n'))
+        demand_profile.pop_due(0)
+        self.assertIsNone(demand_profile.next_time)
+        self.assertTrue(demand_profile._file.closed)
+
+    def test_close_before_exhaustion(self):
+        demand_profile = DemandProfile(self._write_schedule('0,0,10\n10,0,20\n'))
+        demand_profile.close()
+        self.assertTrue(demand_profile._file.closed)
+        self.assertIsNone(demand_profile.next_time)
+        self.assertEqual(demand_profile.pop_due(20), [])
+
+    def test_malformed_row_after_the_header_raises(self):
+        demand_profile = DemandProfile(self._write_schedule('time,generator,rate\n0,0,10\n10,zero,20\n'))
+        with self.assertRaises(ValueError):
+            demand_profile.pop_due(0)
+        demand_profile.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
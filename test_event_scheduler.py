@@ -0,0 +1,86 @@
+import unittest
+
+from event_scheduler import EventScheduler
+
+
+class EventSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = EventScheduler()
+        self.calls = []
+
+    def _callback(self, name, next_due_time=None):
+        """ Returns a callback recording its calls, which schedules its entry next at next_due_time """
+        def callback(t):
+            self.calls.append((name, t))
+            return next_due_time
+        return callback
+
+    def test_runs_due_entries_in_time_order(self):
+        self.scheduler.register(self._callback('b'), 2)
+        self.scheduler.register(self._callback('a'), 1)
+        self.scheduler.register(self._callback('c'), 3)
+        self.scheduler.run_due(2)
+        self.assertEqual(self.calls, [('a', 2), ('b', 2)])
+
+    def test_callback_reschedules_its_entry(self):
+        def callback(t):
+            self.calls.append(('a', t))
+            return t + 4
+
+        self.scheduler.register(callback, 1)
+        for t in range(8):
+            self.scheduler.run_due(t)
+        self.assertEqual(self.calls, [('a', 1), ('a', 5)])
+
+    def test_rescheduled_entry_only_runs_at_its_new_time(self):
+        handle = self.scheduler.register(self._callback('a'), 1)
+        self.scheduler.reschedule(handle, 3)
+        self.scheduler.run_due(2)
+        self.assertEqual(self.calls, [])
+        self.scheduler.run_due(3)
+        self.assertEqual(self.calls, [('a', 3)])
+        # The outdated heap item at time 1 doesn't run it again
+        self.scheduler.run_due(4)
+        self.assertEqual(self.calls, [('a', 3)])
+
+    def test_unscheduled_entry_never_runs(self):
+        handle = self.scheduler.register(self._callback('a'), 1)
+        self.scheduler.reschedule(handle, None)
+        self.scheduler.run_due(10)
+        self.assertEqual(self.calls, [])
+
+    def test_unscheduled_entry_is_not_registered_in_the_heap(self):
+        self.scheduler.register(self._callback('a'))
+        self.scheduler.run_due(10)
+        self.assertEqual(self.calls, [])
+
+    def test_same_time_entries_run_by_priority_then_registration(self):
+        self.scheduler.register(self._callback('b'), 1)
+        self.scheduler.register(self._callback('c'), 1)
+        self.scheduler.register(self._callback('a'), 1, priority=-1)
+        self.scheduler.run_due(1)
+        self.assertEqual([name for name, t in self.calls], ['a', 'b', 'c'])
+
+    def test_entry_rescheduled_by_an_earlier_callback_does_not_run(self):
+        later = self.scheduler.register(self._callback('later'), 1)
+
+        def reschedule_later(t):
+            self.calls.append(('first', t))
+            self.scheduler.reschedule(later, 5)
+
+        self.scheduler.register(reschedule_later, 1, priority=-1)
+        self.scheduler.run_due(1)
+        self.assertEqual(self.calls, [('first', 1)])
+        self.scheduler.run_due(5)
+        self.assertEqual(self.calls, [('first', 1), ('later', 5)])
+
+    def test_entry_rescheduled_to_now_runs_upon_next_call(self):
+        self.scheduler.register(self._callback('a', next_due_time=0), 0)
+        self.scheduler.run_due(0)
+        self.assertEqual(self.calls, [('a', 0)])
+        self.scheduler.run_due(0)
+        self.assertEqual(self.calls, [('a', 0), ('a', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from functools import partial
+from math import inf
+
+from grid_scenario import DEFAULT_CYCLE, DEFAULT_DURATIONS, build_grid
+from signal_timing_optimizer import PRUNE_CHECK_INTERVAL, SignalPlan, evaluate_plan
+
+HORIZON = 600
+
+
+class EvaluatePlanTest(unittest.TestCase):
+    def setUp(self):
+        self.sims = []
+
+    def _scenario(self):
+        """ Builds a single junction grid, keeping the simulation to inspect where it stopped """
+        sim = build_grid(1, 1, demand=30, dt=0.1)
+        self.sims.append(sim)
+        return sim
+
+    def test_colliding_candidate_is_cut_off(self):
+        # Every approach green at once: vehicles cross each other's paths
+        plan = {0: SignalPlan([(True,) * 4], [HORIZON])}
+        evaluation = evaluate_plan(self._scenario, plan, HORIZON)
+        self.assertTrue(evaluation.collision_detected)
+        self.assertEqual(evaluation.score, inf)
+        self.assertLess(self.sims[0].t, HORIZON / 2)
+
+    def test_dominated_candidate_is_pruned(self):
+        plan = {0: SignalPlan(DEFAULT_CYCLE, DEFAULT_DURATIONS)}
+        evaluation = evaluate_plan(self._scenario, plan, HORIZON, bound=0)
+        self.assertTrue(evaluation.pruned)
+        self.assertEqual(evaluation.score, inf)
+        # Stopped at the first dominance check that saw a waiting vehicle, not at the horizon
+        self.assertLess(self.sims[0].t, HORIZON / 2)
+        n_checks = self.sims[0].t / PRUNE_CHECK_INTERVAL
+        self.assertAlmostEqual(n_checks, round(n_checks), delta=0.02)
+
+    def test_candidate_under_bound_runs_to_horizon(self):
+        plan = {0: SignalPlan(DEFAULT_CYCLE, DEFAULT_DURATIONS)}
+        evaluation = evaluate_plan(partial(build_grid, 1, 1, demand=30, dt=0.1), plan, 60)
+        self.assertFalse(evaluation.collision_detected or evaluation.pruned)
+        self.assertLess(evaluation.score, inf)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+
+from simulation import Simulation
+from vehicle import Vehicle
+
+
+def _run_two_vehicles(dt: float, roads, paths, offset: float, stagger: float) -> bool:
+    """ Runs two vehicles, one at the start of each path, until they collide or leave the map, and
+    returns whether they collided
+    :param offset: starting position of the first vehicle along its road
+    :param stagger: how far behind the first vehicle the second one starts
+    """
+    with Simulation(dt=dt) as sim:
+        sim.add_traffic_controllers(roads)
+        sim.add_intersections({0: {1}, 1: {0}})
+        for index, x in ((0, offset), (1, offset - stagger)):
+            road = sim.traffic_controllers[paths[index][0]]
+            vehicle = Vehicle(paths[index], f'vehicle{index}@localhost', 'password')
+            vehicle.index = index
+            vehicle.x = x
+            road.add_vehicle(vehicle)
+            sim.non_empty_roads.add(road.index)
+            sim.n_vehicles_on_map += 1
+        while sim.n_vehicles_on_map and not sim.collision_detected:
+            sim.update()
+        return sim.collision_detected
+
+
+class MergeCollisionTest(unittest.TestCase):
+    DT = 0.25  # A vehicle at full speed moves about 4 m per step, more than the conflict window
+
+    def _run_merge(self, offset: float, stagger: float) -> bool:
+        """ Runs two vehicles towards a merge, one on each inbound road """
+        return _run_two_vehicles(self.DT, [((-20, 0), (0, 0)), ((0, -20), (0, 0)), ((0, 0), (20, 0))],
+                                 [(0, 2), (1, 2)], offset, stagger)
+
+    def test_simultaneous_arrival_collides(self):
+        # Every position within a step must be caught, including those where the vehicles only
+        # overlap along the step in which they leave the inbound roads
+        for i in range(16):
+            offset = i * self.DT
+            with self.subTest(offset=offset):
+                self.assertTrue(self._run_merge(offset, 0))
+
+    def test_staggered_arrival_does_not_collide(self):
+        for i in range(16):
+            offset = i * self.DT
+            with self.subTest(offset=offset):
+                self.assertFalse(self._run_merge(offset, 15))
+
+
+class CrossingCollisionTest(unittest.TestCase):
+    def _run_crossing(self, dt: float, stagger: float) -> bool:
+        """ Runs two vehicles through a perpendicular crossing """
+        return _run_two_vehicles(dt, [((-50, 0), (50, 0)), ((0, -50), (0, 50))], [(0,), (1,)], 0, stagger)
+
+    def test_simultaneous_arrival_collides(self):
+        for dt in (1 / 60, 0.25):
+            with self.subTest(dt=dt):
+                self.assertTrue(self._run_crossing(dt, 0))
+
+    def test_close_stagger_collides(self):
+        # Closest approach of 2 / sqrt(2) m
+        self.assertTrue(self._run_crossing(1 / 60, 2))
+
+    def test_stagger_within_the_window_does_not_collide(self):
+        # Both vehicles are within the collision radius of the crossing at the same time, but their
+        # closest approach is 4.5 / sqrt(2) m
+        for dt in (1 / 60, 0.25):
+            with self.subTest(dt=dt):
+                self.assertFalse(self._run_crossing(dt, 4.5))
+
+
+class RedSignalTest(unittest.TestCase):
+    def test_lead_stops_before_a_red_signal(self):
+        for dt in (1 / 60, 0.25, 0.5):
+            with self.subTest(dt=dt):
+                sim = Simulation(dt=dt)
+                sim.add_traffic_controllers([((0, 0), (100, 0)), ((100, 0), (200, 0))])
+                sim.add_traffic_signal([[0]], [(False,)], slow_distance=50, slow_factor=0.4, stop_distance=15)
+                road = sim.traffic_controllers[0]
+                vehicle = Vehicle((0, 1), 'vehicle@localhost', 'password')
+                road.add_vehicle(vehicle)
+                sim.non_empty_roads.add(0)
+                sim.n_vehicles_on_map += 1
+                for _ in range(round(30 / dt)):
+                    sim.update()
+                sim.close()
+                self.assertIs(vehicle.road, road)
+                self.assertTrue(vehicle.is_stopped)
+                self.assertLess(vehicle.x, road.length)
+
+
+class DemandProfileTest(unittest.TestCase):
+    def _simulation(self, schedule: str) -> Simulation:
+        """ Returns a simulation of a single road with a 60 vehicles per minute generator, whose
+        rate follows the given schedule """
+        file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        file.write(schedule)
+        file.close()
+        self.addCleanup(os.unlink, file.name)
+        sim = Simulation(dt=0.1)
+        sim.add_traffic_controllers([((0, 0), (1000, 0))])
+        sim.add_generator(60, [[1, [0]]])
+        sim.add_demand_profile(file.name)
+        self.addCleanup(sim.close)
+        return sim
+
+    def test_zero_rate_at_start_applies_before_generation(self):
+        sim = self._simulation('time,generator,rate\n0,0,0\n')
+        for _ in range(100):
+            sim.update()
+        self.assertEqual(sim.n_vehicles_generated, 0)
+
+    def test_rate_change_from_zero_resumes_generation(self):
+        sim = self._simulation('0,0,0\n5,0,60\n')
+        while sim.t < 5:
+            sim.update()
+        self.assertEqual(sim.n_vehicles_generated, 0)
+        while sim.t < 10:
+            sim.update()
+        # One vehicle as soon as the rate changes, then one per second
+        self.assertEqual(sim.n_vehicles_generated, 5)
+
+    def test_close_closes_the_schedule(self):
+        sim = self._simulation('0,0,0\n5,0,60\n')
+        sim.update()
+        sim.close()
+        self.assertTrue(all(demand_profile._file.closed for demand_profile in sim._demand_profiles))
+
+
+if __name__ == '__main__':
+    unittest.main()
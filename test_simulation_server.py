@@ -0,0 +1,82 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from grid_scenario import build_grid
+from simulation_server import REQUEST, SimulationClient, SimulationServer
+
+CLIENT = '''
+import sys
+from simulation_server import SimulationClient
+client = SimulationClient(sys.argv[1], sys.argv[2])
+print(client.step(n_ticks=10))
+client.close()
+'''
+
+
+class SimulationServerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.socket_path = os.path.join(directory, 'simulation.sock')
+        self.sim = build_grid(1, 1, demand=10, dt=0.1)
+        self.server = SimulationServer(self.sim, self.socket_path)
+        self.addCleanup(self.server.close)
+        self.addCleanup(self.sim.close)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        # Stop the server without attaching to its shared memory, which a failing test may have lost
+        if self.thread.is_alive():
+            self._connect().sendall(REQUEST.pack(-1, 0))
+        self.thread.join(timeout=10)
+
+    def _connect(self) -> socket.socket:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.socket_path)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_successive_client_processes(self):
+        # A client process exiting must leave the shared memory block to the next ones
+        for step in (10, 20):
+            output = subprocess.run([sys.executable, '-c', CLIENT, self.socket_path, self.server.shm_name],
+                                    capture_output=True, text=True, check=True).stdout
+            self.assertEqual(output.splitlines()[-1], str(step))
+        client = SimulationClient(self.socket_path, self.server.shm_name)
+        self.assertEqual(client.observe().step, 20)
+        client.close()
+
+    def test_invalid_requests_only_drop_their_connection(self):
+        for request in (REQUEST.pack(1, 10 ** 9), REQUEST.pack(1, -1)):
+            connection = self._connect()
+            connection.sendall(request)
+            self.assertEqual(connection.recv(8), b'')
+        client = SimulationClient(self.socket_path, self.server.shm_name)
+        with self.assertRaises(ConnectionError):
+            client.step([(5, 0)])
+        client.close()
+        client = SimulationClient(self.socket_path, self.server.shm_name)
+        self.assertEqual(client.step(n_ticks=3), 3)
+        client.close()
+
+    def test_partial_request_does_not_stall_other_clients(self):
+        stalled = self._connect()
+        stalled.sendall(REQUEST.pack(1, 0)[:3])
+        client = SimulationClient(self.socket_path, self.server.shm_name)
+        self.assertEqual(client.step(n_ticks=2), 2)
+        # The rest of the request completes it
+        stalled.sendall(REQUEST.pack(1, 0)[3:])
+        stalled.settimeout(10)
+        self.assertEqual(len(stalled.recv(8)), 8)
+        self.assertEqual(client.observe().step, 3)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
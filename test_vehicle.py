@@ -0,0 +1,33 @@
+import unittest
+
+from simulation import Simulation
+from vehicle import Vehicle
+
+
+class VehicleTest(unittest.TestCase):
+    def setUp(self):
+        sim = Simulation()
+        sim.add_traffic_controllers([((0, 0), (30, 40)), ((30, 40), (30, 100))])
+        self.roads = sim.traffic_controllers
+        self.vehicle = Vehicle((0, 1), 'vehicle@localhost', 'password')
+        self.roads[0].add_vehicle(self.vehicle)
+
+    def test_position_follows_the_road(self):
+        self.vehicle.x = 10
+        self.assertEqual(self.vehicle.road, self.roads[0])
+        self.assertEqual(self.vehicle.position, (6, 8))
+
+    def test_change_road_carries_the_overshoot(self):
+        self.vehicle.x = 48
+        self.vehicle.update(None, 0.25, self.roads[0])
+        x0, x1 = self.vehicle.step_offsets(self.roads[0])
+        self.vehicle.change_road(self.roads[1])
+        self.assertEqual(self.vehicle.current_road_index, 1)
+        self.assertIs(self.vehicle.road, self.roads[1])
+        self.assertAlmostEqual(self.vehicle.x, x1 - 50)
+        self.assertEqual(self.vehicle.step_offsets(self.roads[1]), (x0 - 50, x1 - 50))
+        self.assertAlmostEqual(self.vehicle.position[1], 40 + x1 - 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from simulation import Simulation
+from vehicle_pool import VehiclePool
+
+
+class VehiclePoolTest(unittest.TestCase):
+    def test_released_vehicle_is_reused_in_its_initial_state(self):
+        with Simulation() as sim:
+            sim.add_traffic_controllers([((0, 0), (100, 0))])
+            pool = VehiclePool()
+            vehicle = pool.acquire((0, 1, 2), 3)
+            vehicle.road = sim.traffic_controllers[0]
+            vehicle.x, vehicle.current_road_index = 50, 2
+            vehicle.slow(0.4)
+            vehicle.stop(10)
+            pool.release(vehicle)
+
+            reused = pool.acquire((0,), 0)
+            self.assertIs(reused, vehicle)
+            self.assertEqual(pool.n_created, 1)
+            self.assertEqual((reused.path, reused.path_id), ((0,), 0))
+            self.assertEqual((reused.x, reused.current_road_index, reused.v_max), (0, 0, 16.6))
+            self.assertFalse(reused.is_stopped)
+            self.assertIsNone(reused.road)
+
+    def test_vehicles_leaving_the_map_are_recycled(self):
+        with Simulation(dt=0.1) as sim:
+            # A vehicle crosses the road in under a second, and one is generated every 2 s
+            sim.add_traffic_controllers([((0, 0), (10, 0))])
+            sim.add_generator(30, [[1, [0]]])
+            while sim.n_vehicles_generated < 5:
+                sim.update()
+            self.assertEqual(sim._vehicle_pool.n_created, 1)
+            vehicle = sim.traffic_controllers[0].vehicles[0]
+            self.assertIs(vehicle.road, sim.traffic_controllers[0])
+            self.assertEqual(vehicle.index, 4)
+
+    def test_vehicle_blocked_at_generation_returns_to_the_pool(self):
+        with Simulation(dt=0.1) as sim:
+            sim.add_traffic_controllers([((0, 0), (100, 0)), ((100, 0), (200, 0))])
+            sim.add_traffic_signal([[0]], [(False,)], slow_distance=50, slow_factor=0.4, stop_distance=15)
+            # Generations every 0.1 s, which the vehicles queued at the red signal soon block
+            sim.add_generator(600, [[1, [0, 1]]])
+            for _ in range(600):
+                sim.update()
+            n_vehicles = len(sim.traffic_controllers[0].vehicles)
+            self.assertEqual(sim.n_vehicles_generated, n_vehicles)
+            self.assertLess(n_vehicles, 60)
+            # Every blocked generation attempt took a vehicle from the pool and gave it back
+            self.assertEqual(sim._vehicle_pool.n_created, n_vehicles + 1)
+
+
+class PathInterningTest(unittest.TestCase):
+    def test_vehicles_on_the_same_path_share_it(self):
+        with Simulation(dt=0.1) as sim:
+            sim.add_traffic_controllers([((0, 0), (100, 0)), ((0, 10), (100, 10)), ((100, 0), (200, 0))])
+            sim.add_generator(60, [[1, [0, 2]]])
+            sim.add_generator(60, [[1, [1]], [1, [0, 2]]])
+            self.assertEqual(sim.paths, [(0, 2), (1,)])
+            while sim.n_vehicles_generated < 10:
+                sim.update()
+            vehicles = [vehicle for i in sim.non_empty_roads for vehicle in sim.traffic_controllers[i].vehicles]
+            for vehicle in vehicles:
+                self.assertIs(vehicle.path, sim.paths[vehicle.path_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
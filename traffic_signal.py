@@ -1,9 +1,11 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
 class TrafficSignal:
     def __init__(self, traffic_controllers: List[List], cycle: List[Tuple],
-                 slow_distance: float, slow_factor: float, stop_distance: float):
+                 slow_distance: float, slow_factor: float, stop_distance: float,
+                 durations: Optional[List[float]] = None):
+        self._check_plan(traffic_controllers, cycle, durations)
         self.traffic_controllers: List[List] = traffic_controllers
         # self.roads_indexes: Set[int] = set(road.index for road in chain.from_iterable(roads))
         self.cycle: List[Tuple[bool]] = cycle
@@ -12,6 +14,9 @@ class TrafficSignal:
         self.slow_factor: float = slow_factor
         self.stop_distance: float = stop_distance
         self.prev_update_time: float = 0
+        # Fixed-time plan: simulation seconds spent in each phase of the cycle. None when the
+        # signal is switched externally (run() actions, LQF heuristic)
+        self.durations: Optional[List[float]] = durations
         for i in range(len(self.traffic_controllers)):
             for road in self.traffic_controllers[i]:
                 road.set_traffic_signal(self, i)
@@ -20,5 +25,43 @@ class TrafficSignal:
     def current_cycle(self) -> Tuple:
         return self.cycle[self.current_cycle_index]
 
-    def update(self):
-        self.current_cycle_index = (self.current_cycle_index + 1) % len(self.cycle)
+    @property
+    def next_switch_time(self) -> Optional[float]:
+        """ Returns the simulation time of the next phase change of a fixed-time plan, else None """
+        if self.durations is None:
+            return None
+        return self.prev_update_time + self.durations[self.current_cycle_index]
+
+    @staticmethod
+    def _check_plan(traffic_controllers: List[List], cycle: List[Tuple], durations: Optional[List[float]]) -> None:
+        """ Raises a ValueError unless every phase has a state per group and every phase a duration """
+        for phase in cycle:
+            if len(phase) != len(traffic_controllers):
+                raise ValueError(f'Expected phases of {len(traffic_controllers)} group states, got {phase}')
+        if durations is not None and len(durations) != len(cycle):
+            raise ValueError(f'Expected {len(cycle)} phase durations, got {len(durations)}')
+
+    def set_plan(self, cycle: List[Tuple], durations: Optional[List[float]], t: float) -> None:
+        """ Replaces the phase cycle (and, optionally, the phase durations) and restarts it at time t """
+        self._check_plan(self.traffic_controllers, cycle, durations)
+        previous_cycle = self.current_cycle
+        self.cycle = cycle
+        self.durations = durations
+        self.current_cycle_index = 0
+        self._notify_roads(previous_cycle, t)
+
+    def set_phase(self, index: int, t: float) -> None:
+        """ Switches to the given phase of the cycle at time t """
+        previous_cycle = self.current_cycle
+        self.current_cycle_index = index % len(self.cycle)
+        self._notify_roads(previous_cycle, t)
+
+    def _notify_roads(self, previous_cycle: Tuple, t: float) -> None:
+        """ Notifies the roads of the groups that turned green, once per phase change """
+        for i, state in enumerate(self.current_cycle):
+            if state and not previous_cycle[i]:
+                for road in self.traffic_controllers[i]:
+                    road.notify_vehicles_to_start(t)
+
+    def update(self, t: float):
+        self.set_phase(self.current_cycle_index + 1, t)
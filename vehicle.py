@@ -5,13 +5,15 @@ from spade.message import Message
 import asyncio
 import spade
 
-from typing import List, Tuple
+from typing import Tuple
 
 import numpy as np
 
+MIN_GAP = 0.1  # Lower bound of the gap to the lead, keeps the IDM interaction term finite
+
 
 class Vehicle(Agent):
-    def __init__(self, path: List[int], jid, password):
+    def __init__(self, path: Tuple[int, ...], jid, password, path_id: int = 0):
         super().__init__(jid, password)
         # self.environment = environment
         print(jid)
@@ -28,6 +30,11 @@ class Vehicle(Agent):
         self.sqrt_ab = 2 * np.sqrt(self.a_max * self.b_max)
         self._v_max = self.v_max
 
+        self.reset(path, path_id)
+
+    def reset(self, path: Tuple[int, ...], path_id: int) -> None:
+        """ Puts the vehicle back in its initial state, to be reused by a VehiclePool """
+        self.v_max = self._v_max
         self.v = self.v_max  # Velocity
         self.a = 0  # Acceleration
         self.x = 0  # Position, relative to its current roadM
@@ -36,11 +43,16 @@ class Vehicle(Agent):
         self._last_time_stopped = None
         self._waiting_time = 0
 
-        self.path: List[int] = path  # Road indexes
+        self.path: Tuple[int, ...] = path  # Road indexes, shared by all the vehicles on that path
+        self.path_id: int = path_id
         self.current_road_index = 0
 
-        # Used for collision detection, value set upon adding it to the map in vehicle.update()
-        self.position: Tuple = (None, None)
+        # Current road, set upon adding the vehicle to a road (see Road.add_vehicle). World
+        # positions are computed on demand from it
+        self.road = None
+        # Road and position along it before the last time step
+        self._prev_road = None
+        self._prev_x: float = 0
 
     async def setup(self):
         # Define a behavior to interact with the environment and air traffic control
@@ -75,6 +87,32 @@ class Vehicle(Agent):
     def __str__(self):
         return f'Vehicle {self.index}'
 
+    @property
+    def position(self) -> Tuple[float, float]:
+        """ Returns the world coordinates of the vehicle, computed on demand from its road """
+        road = self.road
+        return road.start[0] + road.angle_cos * self.x, road.start[1] + road.angle_sin * self.x
+
+    def step_offsets(self, road) -> Tuple[float, float]:
+        """ Returns the positions along the given (current) road at the start and at the end of
+        the last time step. A vehicle that changed road along the step starts at a negative position,
+        as if the new road extended backwards. A vehicle that was just generated didn't move """
+        if self._prev_road is road:
+            return self._prev_x, self.x
+        return self.x, self.x
+
+    def change_road(self, road) -> None:
+        """ Moves the vehicle to the next road of its path, which starts where the current one ends.
+        The distance travelled past the end of the current road, and the last time step, are carried
+        over in the coordinates of the next road """
+        length = self.road.length
+        self.x -= length
+        if self._prev_road is not None:
+            self._prev_road = road
+            self._prev_x -= length
+        self.road = road
+        self.current_road_index += 1
+
     def get_wait_time(self, sim_t):
         if self.is_stopped:
             return self._waiting_time + (sim_t - self._last_time_stopped)
@@ -87,18 +125,26 @@ class Vehicle(Agent):
         :param lead: vehicle
         :param dt: simulation time step
         """
-        # Update position and velocity
+        self._prev_road, self._prev_x = road, self.x
+
+        # Update position and velocity (ballistic update: exact for a constant acceleration along
+        # the step, and the vehicle stops instead of reversing, so it stays stable for large steps)
         if self.v + self.a * dt < 0:
             self.x -= 1 / 2 * self.v * self.v / self.a
             self.v = 0
         else:
-            self.v += self.a * dt
             self.x += self.v * dt + self.a * dt * dt / 2
+            self.v += self.a * dt
 
         # Update acceleration
         alpha = 0
         if lead:
-            delta_x = lead.x - self.x - lead.length
+            # With large steps the vehicle could move past the lead's rear, never overtake it
+            rear = lead.x - lead.length
+            if self.x > rear:
+                self.x = rear
+                self.v = min(self.v, lead.v)
+            delta_x = max(lead.x - self.x - lead.length, MIN_GAP)
             delta_v = self.v - lead.v
 
             alpha = (self.s0 + max(0, self.T * self.v + delta_v * self.v / self.sqrt_ab)) / delta_x
@@ -108,12 +154,6 @@ class Vehicle(Agent):
         if self.is_stopped:
             self.a = -self.b_max * self.v / self.v_max
 
-        # Update position
-        sin, cos = road.angle_sin, road.angle_cos
-        x = road.start[0] + cos * self.x
-        y = road.start[1] + sin * self.x
-        self.position = x, y
-
     def stop(self, t):
         if not self.is_stopped:
             self._last_time_stopped = t
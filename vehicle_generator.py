@@ -1,29 +1,49 @@
-from typing import List, Dict, Optional
+from math import inf
+from typing import List, Dict, Optional, Tuple
 
 from numpy.random import randint
 
 from traffic_controller import TrafficController
 from vehicle import Vehicle
+from vehicle_pool import VehiclePool
 
 
 class VehicleGenerator:
-    def __init__(self, vehicle_rate: int, paths: List[List], inbound_roads: Dict[int, TrafficController]):
+    def __init__(self, vehicle_rate: int, paths: List[Tuple[int, int]], inbound_roads: Dict[int, TrafficController],
+                 path_table: List[Tuple[int, ...]], vehicle_pool: VehiclePool):
+        """
+        :param paths: (weight, path id) of the vehicle paths
+        :param path_table: interned paths, indexed by path id
+        :param vehicle_pool: pool the vehicles are taken from
+        """
         self._vehicle_rate: int = vehicle_rate
-        self._paths: List[List] = paths
+        self._paths: List[Tuple[int, int]] = paths
+        self._total_weight: int = sum(weight for weight, path_id in paths)
+        self._path_table: List[Tuple[int, ...]] = path_table
+        self._vehicle_pool: VehiclePool = vehicle_pool
         self._prev_gen_time: float = 0
 
         # Storing the list of the first roads of the vehicle paths. Used in the update() function
         # upon vehicle generation to check if there's sufficient space in the road to add a vehicle
         self._inbound_roads: Dict[int, TrafficController] = inbound_roads
 
+    @property
+    def next_generation_time(self) -> float:
+        """ Returns the time from which the next vehicle can be generated, inf if the rate is zero """
+        if self._vehicle_rate <= 0:
+            return inf
+        return self._prev_gen_time + 60 / self._vehicle_rate
+
+    def set_vehicle_rate(self, vehicle_rate: float) -> None:
+        self._vehicle_rate = vehicle_rate
+
     def _generate_vehicle(self) -> Vehicle:
         """Returns a random vehicle from self.vehicles with random proportions"""
-        total = sum(weight for weight, path in self._paths)
-        r = randint(0, total)
-        for (weight, path) in self._paths:
+        r = randint(0, self._total_weight)
+        for (weight, path_id) in self._paths:
             r -= weight
             if r <= 0:
-                return Vehicle(path, "aircraft@localhost", "password")
+                return self._vehicle_pool.acquire(self._path_table[path_id], path_id)
 
     #async def vehicle_agent(self, path):
         # Create and initialize the environment
@@ -42,6 +62,8 @@ class VehicleGenerator:
         """
         # If there's no vehicles on the map, or if the time elapsed after last
         # generation is greater than the vehicle rate, generate a vehicle
+        if self._vehicle_rate <= 0:
+            return None
         time_elapsed = curr_t - self._prev_gen_time >= 60 / self._vehicle_rate
         if not n_vehicles_generated or time_elapsed:
             vehicle: Vehicle = self._generate_vehicle()
@@ -49,7 +71,8 @@ class VehicleGenerator:
             # If the road is empty, or there's sufficient space for the generated vehicle, add it
             if not road.vehicles or road.vehicles[-1].x > vehicle.s0 + vehicle.length:
                 vehicle.index = n_vehicles_generated
-                road.vehicles.append(vehicle)
+                road.add_vehicle(vehicle)
                 self._prev_gen_time = curr_t
                 return road.index
+            self._vehicle_pool.release(vehicle)
         return None
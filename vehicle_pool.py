@@ -0,0 +1,25 @@
+from typing import List, Tuple
+
+from vehicle import Vehicle
+
+
+class VehiclePool:
+    def __init__(self, jid: str = "aircraft@localhost", password: str = "password"):
+        """ Recycles the vehicles that left the map, instead of constructing a new agent per vehicle """
+        self._jid: str = jid
+        self._password: str = password
+        self._free: List[Vehicle] = []
+        self.n_created: int = 0
+
+    def acquire(self, path: Tuple[int, ...], path_id: int) -> Vehicle:
+        """ Returns a vehicle in its initial state, following the given (interned) path """
+        if self._free:
+            vehicle = self._free.pop()
+            vehicle.reset(path, path_id)
+            return vehicle
+        self.n_created += 1
+        return Vehicle(path, self._jid, self._password, path_id)
+
+    def release(self, vehicle: Vehicle) -> None:
+        """ Returns a vehicle that is no longer on the map to the pool """
+        self._free.append(vehicle)
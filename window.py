@@ -1,8 +1,15 @@
+from itertools import repeat
+from typing import Optional
+
 import numpy as np
 import pygame
 from pygame.draw import polygon
 
 
+# Below this zoom (pixels per meter), vehicles are drawn as pixel blocks and road arrows are hidden
+LOD_ZOOM = 2
+VEHICLE_COLOR = (82, 166, 232)
+
 # # For debugging purposes
 # DRAW_VEHICLE_IDS = True
 # DRAW_ROAD_IDS = False
@@ -29,6 +36,9 @@ class Window:
         self._mouse_last = (0, 0)
         self._mouse_down = False
 
+        # Per road [start x, start y, cos, sin], indexed by road index. Built upon the first draw
+        self._road_geometry: Optional[np.ndarray] = None
+
     def update(self) -> None:
         self._draw()
         pygame.display.update()
@@ -36,6 +46,18 @@ class Window:
             # Quit program if window is closed
             if event.type == pygame.QUIT:
                 self.closed = True
+            # Zoom with the mouse wheel, pan by dragging
+            elif event.type == pygame.MOUSEWHEEL:
+                self._zoom = min(max(self._zoom * 1.1 ** event.y, 0.1), 50)
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                self._mouse_down = True
+                self._mouse_last = event.pos
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                self._mouse_down = False
+            elif event.type == pygame.MOUSEMOTION and self._mouse_down:
+                self._offset = (self._offset[0] + (event.pos[0] - self._mouse_last[0]) / self._zoom,
+                                self._offset[1] + (event.pos[1] - self._mouse_last[1]) / self._zoom)
+                self._mouse_last = event.pos
 
     def _convert(self, x, y=None):
         """Converts simulation coordinates to screen coordinates"""
@@ -116,7 +138,7 @@ class Window:
             # road_index_coordinates.append((road.index, screen_x, screen_y))
 
             # Draw road arrow
-            if road.length > 5:
+            if road.length > 5 and self._zoom >= LOD_ZOOM:
                 for i in np.arange(-0.5 * road.length, 0.5 * road.length, 10):
                     pos = (road.start[0] + (road.length / 2 + i + 3) * road.angle_cos,
                            road.start[1] + (road.length / 2 + i + 3) * road.angle_sin)
@@ -129,38 +151,72 @@ class Window:
         #         text_road_index = self._text_font.render(f'{cords[0]}', True, (0, 0, 0))
         #         self._screen.blit(text_road_index, (cords[1] - 5, cords[2] - 5))
 
-    def _draw_vehicle(self, vehicle, road) -> None:
-        l, h = vehicle.length, vehicle.width
-        sin, cos = road.angle_sin, road.angle_cos
-        x = road.start[0] + cos * vehicle.x
-        y = road.start[1] + sin * vehicle.x
-        self._rotated_box((x, y), (l, h), cos=cos, sin=sin, centered=True)
-
-        #radius = vehicle.width*4  # Usando a metade da largura como raio para representar um círculo
-        #x = road.start[0] + road.angle_cos * vehicle.x
-        #y = road.start[1] + road.angle_sin * vehicle.x
-
-        #center = self._convert(x, y)
-        #pygame.draw.circle(self._screen, (255, 0, 0), center, int(radius))
-
-        # # For debugging purposes
-        # screen_x, screen_y = self._rotated_box((x, y), (l, h), cos=cos, sin=sin, centered=True)
-        # if DRAW_VEHICLE_IDS:
-        #     text_road_index = self._text_font.render(f'{vehicle.index}', True, (255, 255, 255),
-        #                                              (0, 0, 0))
-        #     self._screen.blit(text_road_index, (screen_x - 5, screen_y - 5))
-
     def _draw_vehicles(self) -> None:
+        """ Draws every vehicle with a single coordinates' transformation, culling those outside the screen """
+        roads = self._sim.traffic_controllers
+        if self._road_geometry is None or len(self._road_geometry) != len(roads):
+            self._road_geometry = np.array([(*road.start, road.angle_cos, road.angle_sin) for road in roads],
+                                           dtype=float).reshape(-1, 4)
+
+        road_indexes, xs = [], []
         for i in self._sim.non_empty_roads:
-            road = self._sim.traffic_controllers[i]
-            for vehicle in road.vehicles:
-                self._draw_vehicle(vehicle, road)
+            vehicles = roads[i].vehicles
+            road_indexes.extend(repeat(i, len(vehicles)))
+            xs.extend(vehicle.x for vehicle in vehicles)
+        if not xs:
+            return
+
+        geometry = self._road_geometry[road_indexes]
+        cos, sin = geometry[:, 2], geometry[:, 3]
+        x = np.asarray(xs)
+        screen_size = np.array((self._width, self._height))
+        # Vehicle centres, in screen coordinates
+        centres = ((geometry[:, :2] + x[:, None] * geometry[:, 2:] + self._offset) * self._zoom
+                   + screen_size / 2)
+
+        if self._zoom < LOD_ZOOM:
+            self._draw_vehicle_pixels(centres)
+            return
+
+        # All vehicles share the same dimensions
+        vehicle = roads[road_indexes[0]].vehicles[0]
+        l, h = vehicle.length, vehicle.width
+        margin = max(l, h) * self._zoom
+        visible = np.all((centres >= -margin) & (centres < screen_size + margin), axis=1)
+        if not visible.any():
+            return
+
+        centres, cos, sin = centres[visible], cos[visible], sin[visible]
+        # Vertices (e1, e2) of each box, as in _rotated_box
+        e1 = np.array((-1, -1, 1, 1))
+        e2 = np.array((-1, 1, 1, -1))
+        half_zoom = self._zoom / 2
+        vertices = np.empty((len(centres), 4, 2))
+        vertices[:, :, 0] = centres[:, :1] + (np.outer(cos, e1 * l) + np.outer(sin, e2 * h)) * half_zoom
+        vertices[:, :, 1] = centres[:, 1:] + (np.outer(sin, e1 * l) - np.outer(cos, e2 * h)) * half_zoom
+        for points in vertices.astype(int).tolist():
+            polygon(self._screen, VEHICLE_COLOR, points)
+
+    def _draw_vehicle_pixels(self, centres: np.ndarray) -> None:
+        """ Level of detail for zoomed out views: writes a 2x2 pixel block per vehicle whose block
+        lies entirely on the screen """
+        cells = np.floor(centres).astype(int)
+        visible = np.all((cells >= 0) & (cells < (self._width - 1, self._height - 1)), axis=1)
+        if not visible.any():
+            return
+        cols, rows = cells[visible].T
+        pixels = pygame.surfarray.pixels3d(self._screen)
+        for dx in (0, 1):
+            for dy in (0, 1):
+                pixels[cols + dx, rows + dy] = VEHICLE_COLOR
+        # Unlock the surface
+        del pixels
 
     def _draw_signals(self) -> None:
         for signal in self._sim.traffic_signals:
             for i in range(len(signal.traffic_controllers)):
                 red, green = (255, 0, 0), (0, 255, 0)
-                if signal.current_cycle == (False, False):
+                if not any(signal.current_cycle):
                     # Temp state, yellow color
                     yellow = (255, 255, 0)
                     color = yellow if signal.cycle[signal.current_cycle_index - 1][i] else red